@@ -0,0 +1,374 @@
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import platform
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import _make_key
+from pathlib import Path
+
+import lru_cache as lru_cache_module
+from keys import freeze, make_key
+from lru_cache import LRUCache, lru_cache
+from linked_list import Node
+from policies import POLICIES
+
+"""
+Benchmarks for `lru_cache.py`
+"""
+
+
+def identity(n):
+    return n
+
+
+def benchmark_hit_latency(sizes=(10, 1_000, 100_000, 1_000_000), number=200_000):
+    """ Mean latency of a cache hit for caches with different `max_size` """
+    LRUCache.DEBUG = False
+
+    print(f'\nHit latency ({number} hits per size)')
+    for size in sizes:
+        cached = lru_cache(max_size=size)(identity)
+        for n in range(size):
+            cached(n)
+
+        # keys are spread over the whole cache, so the position of a node in the list doesn't matter
+        keys = [random.randrange(size) for _ in range(number)]
+        duration = timeit.timeit(lambda: [cached(key) for key in keys], number=1)
+        print(f'max_size={size:>9}: {duration / number * 1e9:7.1f} ns/hit')
+
+
+def benchmark_sharded_throughput(shards=(1, 4, 16), threads=8, ops=50_000, max_size=10_000):
+    """ Throughput of `ShardedLRUCache` called from a pool of threads (~90% of calls are hits) """
+    LRUCache.DEBUG = False
+
+    print(f'\nSharded cache throughput ({threads} threads x {ops} calls, max_size={max_size})')
+    for shards_number in shards:
+        cached = lru_cache(max_size=max_size, shards=shards_number)(identity)
+        keys = [random.randrange(int(max_size * 1.1)) for _ in range(ops)]
+
+        def worker():
+            for key in keys:
+                cached(key)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start_time = timeit.default_timer()
+            futures = [executor.submit(worker) for _ in range(threads)]
+            for future in futures:
+                future.result()
+            duration = timeit.default_timer() - start_time
+        info = cached.cache_info()
+        print(f'shards={shards_number:>3}: {threads * ops / duration:12,.0f} calls/s, hit_ratio={info["hit_ratio"]:.2%}')
+
+
+def benchmark_make_key(number=200_000):
+    """ Latency of building a key by `make_key` compared with `functools._make_key` (key of `functools.lru_cache`) """
+    calls = {
+        'args (1, 2)': ((1, 2), {}),
+        'args + kwargs': ((1,), {'x': 2, 'y': 3}),
+        'list argument': (([1, 2, 3],), {}),
+    }
+    print(f'\nKey building ({number} keys per case)')
+    for name, (args, kwargs) in calls.items():
+        durations = {}
+        for typed in (False, True):
+            if name != 'list argument':
+                durations[f'functools{" typed" if typed else ""}'] = timeit.timeit(
+                    lambda: _make_key(args, kwargs, typed), number=number)
+            durations[f'make_key{" typed" if typed else ""}'] = timeit.timeit(
+                lambda: make_key(args, kwargs, typed, freeze), number=number)
+            if name == 'args (1, 2)' and not typed:
+                durations['make_key fast path'] = timeit.timeit(lambda: make_key(args, kwargs), number=number)
+        print(f'{name}: ' + ', '.join(f'{key}={duration / number * 1e9:.0f} ns'
+                                      for key, duration in durations.items()))
+
+
+class DictNode:
+    """ Node as it was before `__slots__` (attributes in per-instance `__dict__`) """
+
+    def __init__(self, key, val):
+        self.key = key
+        self.val = val
+        self.next = None
+        self.prev = None
+        self.owner = None
+        self.expires = None
+        self.refresh_at = None
+        self.weight = 0
+
+
+def filled_cache_size(entries, **params):
+    """ Bytes allocated by a cache with `entries` entries (int keys and values) """
+    tracemalloc.start()
+    cached = lru_cache(max_size=entries, **params)(identity)
+    for n in range(1_000_000, 1_000_000 + entries):
+        cached(n)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def benchmark_memory_per_entry(entries=100_000):
+    """ Bytes per entry: Node with `__dict__`, Node with `__slots__`, compact array-backed cache """
+    LRUCache.DEBUG = False
+
+    print(f'\nMemory per entry ({entries} entries, including the key tuple and the value)')
+    lru_cache_module.Node = DictNode
+    try:
+        print(f'Node with __dict__:  {filled_cache_size(entries) / entries:6.1f} B/entry')
+    finally:
+        lru_cache_module.Node = Node
+    print(f'Node with __slots__: {filled_cache_size(entries) / entries:6.1f} B/entry')
+    print(f'compact (arrays):    {filled_cache_size(entries, compact=True) / entries:6.1f} B/entry')
+
+
+SHARED_CACHE = None
+
+
+def replay_local(trace, max_size):
+    """ Worker with its own cache """
+    cached = lru_cache(max_size=max_size)(identity)
+    for key in trace:
+        cached(key)
+    return cached.hits, cached.misses
+
+
+def replay_shared(trace):
+    """ Worker with the cache inherited from the parent process """
+    for key in trace:
+        SHARED_CACHE(key)
+
+
+def benchmark_shared_hit_ratio(workers=8, calls=20_000, keys_number=50_000, max_size=5_000):
+    """ Hit ratio of 8 worker processes with their own caches and with one `SharedLRUCache` """
+    global SHARED_CACHE
+    LRUCache.DEBUG = False
+
+    print(f'\nPer-process vs shared cache ({workers} workers x {calls} calls, max_size={max_size})')
+    traces = [zipf_trace(keys_number, calls, seed=seed) for seed in range(workers)]
+    context = multiprocessing.get_context('fork')
+
+    start_time = timeit.default_timer()
+    with context.Pool(workers) as pool:
+        results = pool.starmap(replay_local, [(trace, max_size) for trace in traces])
+    duration = timeit.default_timer() - start_time
+    hits, misses = sum(result[0] for result in results), sum(result[1] for result in results)
+    print(f'per-process: hit_ratio={hits / (hits + misses):.2%}, {workers * calls / duration:12,.0f} calls/s')
+
+    # the segment is created before the workers are forked, so they all use it
+    SHARED_CACHE = lru_cache(max_size=max_size, shared=True)(identity)
+    try:
+        start_time = timeit.default_timer()
+        with context.Pool(workers) as pool:
+            pool.map(replay_shared, traces)
+        duration = timeit.default_timer() - start_time
+        info = SHARED_CACHE.cache_info()
+        print(f"     shared: hit_ratio={info['hit_ratio']:.2%}, {workers * calls / duration:12,.0f} calls/s")
+    finally:
+        SHARED_CACHE.unlink()
+        SHARED_CACHE = None
+
+
+def zipf_trace(keys_number, length, alpha=1.0, seed=0):
+    """ Keys with Zipf-distributed popularity (a few hot keys and a long tail) """
+    rnd = random.Random(seed)
+    weights = list(itertools.accumulate(1 / rank ** alpha for rank in range(1, keys_number + 1)))
+    return rnd.choices(range(keys_number), cum_weights=weights, k=length)
+
+
+def scan_trace(keys_number, length, scan_length, scan_every, seed=0):
+    """ Zipf trace interrupted by one-off sequential scans over keys that are never requested again """
+    trace = zipf_trace(keys_number, length, seed=seed)
+    scan_keys = itertools.count(keys_number)
+    result = []
+    for start in range(0, length, scan_every):
+        result += trace[start:start + scan_every]
+        result += [next(scan_keys) for _ in range(scan_length)]
+    return result
+
+
+def uniform_trace(keys_number, length, seed=0):
+    """ Keys with the same popularity """
+    rnd = random.Random(seed)
+    return [rnd.randrange(keys_number) for _ in range(length)]
+
+
+def loop_trace(keys_number, length):
+    """ Looping sequential scan over the same keys (the worst case of LRU if the cache is smaller than the loop) """
+    return [n % keys_number for n in range(length)]
+
+
+def load_trace(path):
+    """ Recorded trace: text file with one key per line """
+    with open(path) as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def replay_trace(trace, max_size, policies=tuple(POLICIES)):
+    """ Hit ratio and calls/s of each eviction policy on the trace """
+    LRUCache.DEBUG = False
+
+    results = {}
+    for policy in policies:
+        cached = lru_cache(max_size=max_size, policy=policy)(identity)
+        start_time = timeit.default_timer()
+        for key in trace:
+            cached(key)
+        duration = timeit.default_timer() - start_time
+        results[policy] = {'hit_ratio': cached.cache_info()['hit_ratio'], 'ops': len(trace) / duration}
+    return results
+
+
+def benchmark_policies(traces=None, max_size=1_000):
+    """ Compare eviction policies on recorded traces (or synthetic Zipf / Zipf + scans traces) """
+    if traces is None:
+        traces = {
+            'zipf': zipf_trace(100_000, 200_000),
+            'zipf+scans': scan_trace(100_000, 200_000, scan_length=2 * max_size, scan_every=10_000),
+        }
+
+    print(f'\nEviction policies (max_size={max_size})')
+    for name, trace in traces.items():
+        print(f'{name} ({len(trace)} calls):')
+        for policy, result in replay_trace(trace, max_size).items():
+            print(f"\t{policy:>8}: hit_ratio={result['hit_ratio']:.2%}, {result['ops']:12,.0f} calls/s")
+
+
+def dict_cache(func):
+    """ Plain dict w/o eviction (memoization), the upper bound of speed and hit ratio """
+    cache = {}
+
+    @functools.wraps(func)
+    def wrapper(key):
+        try:
+            return cache[key]
+        except KeyError:
+            result = cache[key] = func(key)
+            return result
+
+    return wrapper
+
+
+# name -> function that wraps the function with the cache of `max_size` entries
+CACHES = {
+    'lru_cache': lambda func, max_size: lru_cache(max_size=max_size)(func),
+    'lru_cache compact': lambda func, max_size: lru_cache(max_size=max_size, compact=True)(func),
+    'lru_cache tinylfu': lambda func, max_size: lru_cache(max_size=max_size, policy='tinylfu')(func),
+    'functools.lru_cache': lambda func, max_size: functools.lru_cache(maxsize=max_size)(func),
+    'dict': lambda func, max_size: dict_cache(func),
+}
+
+
+def quantile(values, q):
+    """ `q`-quantile of sorted values """
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def measure_cache(make_cache, trace, max_size) -> dict:
+    """ Calls/s, p50/p99 latency of a call, hit ratio and memory per entry of the cache on the trace """
+    # hits are counted the same way for all caches: each miss calls the function
+    misses = 0
+
+    def counted(key):
+        nonlocal misses
+        misses += 1
+        return key
+
+    cached = make_cache(counted, max_size)
+    start_time = time.perf_counter()
+    for key in trace:
+        cached(key)
+    duration = time.perf_counter() - start_time
+    hit_ratio = 1 - misses / len(trace)
+
+    # latency is measured on a separate pass: the clock itself is not free (tens of ns per call)
+    cached, latencies = make_cache(identity, max_size), []
+    clock = time.perf_counter_ns
+    for key in trace:
+        start_time = clock()
+        cached(key)
+        latencies.append(clock() - start_time)
+    latencies.sort()
+
+    tracemalloc.start()
+    cached = make_cache(identity, max_size)
+    for n in range(1_000_000, 1_000_000 + max_size):
+        cached(n)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': len(trace) / duration,
+        'p50_ns': quantile(latencies, 0.5),
+        'p99_ns': quantile(latencies, 0.99),
+        'hit_ratio': hit_ratio,
+        'memory_per_entry': memory / max_size,
+    }
+
+
+def benchmark_suite(traces=None, sizes=(100, 1_000, 10_000), caches=CACHES, json_path='benchmark_results.json'):
+    """
+    Compare `lru_cache` (default, compact and W-TinyLFU) with `functools.lru_cache` and a plain dict on Zipf,
+    uniform and looping-scan traces (or recorded ones) for each cache size; results are written to `json_path`
+    """
+    LRUCache.DEBUG = False
+    if traces is None:
+        traces = {
+            'zipf': zipf_trace(100_000, 100_000),
+            'uniform': uniform_trace(20_000, 100_000),
+            'loop': loop_trace(5_000, 100_000),
+        }
+
+    results = []
+    print(f'\nBenchmark suite (sizes: {", ".join(map(str, sizes))})')
+    for trace_name, trace in traces.items():
+        for max_size in sizes:
+            print(f'{trace_name} ({len(trace)} calls), max_size={max_size}:')
+            for cache_name, make_cache in caches.items():
+                result = measure_cache(make_cache, trace, max_size)
+                results.append({'trace': trace_name, 'calls': len(trace), 'max_size': max_size, 'cache': cache_name,
+                                **result})
+                print(f"\t{cache_name:>20}: {result['ops_per_sec']:12,.0f} calls/s, p50={result['p50_ns']} ns, "
+                      f"p99={result['p99_ns']} ns, hit_ratio={result['hit_ratio']:.2%}, "
+                      f"{result['memory_per_entry']:.1f} B/entry")
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version,
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(json_path, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results are written to {json_path}')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the LRU cache')
+    parser.add_argument('traces', nargs='*', help='recorded traces (text files with one key per line)')
+    parser.add_argument('--suite', action='store_true', help='comparative benchmark suite with JSON results')
+    parser.add_argument('--json', default='benchmark_results.json', help='output file of the suite')
+    options = parser.parse_args()
+
+    recorded = {Path(path).name: load_trace(path) for path in options.traces} or None
+    if options.suite:
+        # python benchmark.py --suite [--json results.json] [trace_1.txt ...]
+        benchmark_suite(recorded, json_path=options.json)
+    elif recorded:
+        # python benchmark.py trace_1.txt trace_2.txt ...
+        benchmark_policies(recorded)
+    else:
+        benchmark_hit_latency()
+        benchmark_sharded_throughput()
+        benchmark_make_key()
+        benchmark_policies()
+        benchmark_shared_hit_ratio()
+        benchmark_memory_per_entry()
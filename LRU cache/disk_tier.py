@@ -0,0 +1,186 @@
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+"""
+Second (on-disk) tier of the cache: append-only file of pickled entries, read through `mmap`.
+
+Record: header `RECORD` (length of the key, length of the value, expiration as unix time or 0) + key + value.
+The index (key -> offset of the record) is kept in memory and rebuilt by scanning the file on start,
+a later record of the same key overrides the earlier one. Records of popped and overridden keys become garbage,
+the file is compacted in a background thread when garbage takes more than a half of it. Live records are limited
+by `max_bytes`: the oldest ones become garbage when it's exceeded, expired ones are dropped by compaction.
+"""
+
+RECORD = struct.Struct('<IId')
+# default limit of live records of the tier
+MAX_BYTES = 1 << 30
+
+
+class DiskTier:
+    """ Append-only, memory-mapped file of cache entries with in-memory offset index """
+
+    def __init__(self, path, max_bytes=MAX_BYTES, min_compaction_size=1 << 20):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.min_compaction_size = min_compaction_size
+        self.lock = threading.Lock()
+        self.index = {}
+        self.live_size = 0
+        self.compaction = None
+        self.open()
+
+    def open(self):
+        self.file = open(self.path, 'a+b')
+        self.size = self.file.seek(0, os.SEEK_END)
+        self.map = None
+        self.remap()
+        self.load_index()
+
+    def remap(self):
+        """ (Re)map the whole file, the map has to be recreated after the file has grown """
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def load_index(self):
+        offset, now = 0, time.time()
+        while offset + RECORD.size <= self.size:
+            key_len, val_len, expires = RECORD.unpack_from(self.map, offset)
+            end = offset + RECORD.size + key_len + val_len
+            if end > self.size:
+                break
+            key = pickle.loads(self.map[offset + RECORD.size:offset + RECORD.size + key_len])
+            self.forget(key)
+            if not expires or expires > now:
+                self.index[key] = (offset, key_len, val_len, expires)
+                self.live_size += end - offset
+            offset = end
+        if offset < self.size:
+            # the last record hasn't been written completely (crash)
+            self.file.truncate(offset)
+            self.size = offset
+            self.remap()
+        self.evict()
+
+    def evict(self):
+        """ Drop the oldest records (the index keeps the order of appending) while the live ones exceed `max_bytes` """
+        while self.live_size > self.max_bytes and self.index:
+            self.forget(next(iter(self.index)))
+
+    def forget(self, key):
+        """ Drop the key from the index, its record becomes garbage """
+        entry = self.index.pop(key, None)
+        if entry is not None:
+            self.live_size -= RECORD.size + entry[1] + entry[2]
+        return entry
+
+    def put(self, key, val, expires=0.0):
+        """ Append the entry (`expires` is unix time, 0 means that it doesn't expire) """
+        key_bytes = pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+        val_bytes = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.forget(key)
+            offset = self.size
+            self.file.write(RECORD.pack(len(key_bytes), len(val_bytes), expires or 0.0) + key_bytes + val_bytes)
+            self.file.flush()
+            self.size += RECORD.size + len(key_bytes) + len(val_bytes)
+            self.index[key] = (offset, len(key_bytes), len(val_bytes), expires or 0.0)
+            self.live_size += self.size - offset
+            self.evict()
+            if self.size > self.min_compaction_size and self.live_size < self.size // 2 and self.compaction is None:
+                self.compaction = threading.Thread(target=self.compact, daemon=True)
+                self.compaction.start()
+
+    def pop(self, key):
+        """ Remove the entry from the tier and return (value, expires) or None if it's missing or expired """
+        with self.lock:
+            entry = self.forget(key)
+            if entry is None:
+                return None
+            offset, key_len, val_len, expires = entry
+            if expires and expires <= time.time():
+                return None
+            if self.map is None or len(self.map) < self.size:
+                self.remap()
+            start = offset + RECORD.size + key_len
+            val_bytes = self.map[start:start + val_len]
+        return pickle.loads(val_bytes), expires
+
+    def compact(self):
+        """ Rewrite live (not expired) records into a new file and replace the old one with it """
+        tmp_path = self.path + '.compact'
+        with self.lock:
+            now = time.time()
+            snapshot = {key: entry for key, entry in self.index.items() if not entry[3] or entry[3] > now}
+            end = self.size
+            if self.map is None or len(self.map) < self.size:
+                self.remap()
+            old_map = self.map
+            # the old map isn't closed by `remap` during the copying: a new one will be created instead
+            self.map = None
+
+        # records are never changed after they've been written, so they are copied without the lock
+        offsets = {}
+        with open(tmp_path, 'wb') as tmp:
+            for key, (offset, key_len, val_len, expires) in snapshot.items():
+                offsets[key] = tmp.tell()
+                tmp.write(old_map[offset:offset + RECORD.size + key_len + val_len])
+            copied = tmp.tell()
+
+            with self.lock:
+                # records appended during the copying
+                self.file.seek(end)
+                tail = self.file.read(self.size - end)
+                tmp.write(tail)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+
+                index = {}
+                for key, entry in self.index.items():
+                    offset = entry[0]
+                    if offset >= end:
+                        index[key] = (copied + offset - end, *entry[1:])
+                    elif key in offsets:
+                        index[key] = (offsets[key], *entry[1:])
+                    # else the record has expired and hasn't been copied
+                os.replace(tmp_path, self.path)
+                old_map.close()
+                if self.map is not None:
+                    self.map.close()
+                self.file.close()
+                self.file = open(self.path, 'a+b')
+                self.size = self.file.seek(0, os.SEEK_END)
+                self.map = None
+                self.remap()
+                self.index = index
+                self.live_size = sum(RECORD.size + entry[1] + entry[2] for entry in index.values())
+                self.compaction = None
+
+    def wait_compaction(self):
+        compaction = self.compaction
+        if compaction is not None:
+            compaction.join()
+
+    def clear(self):
+        self.wait_compaction()
+        with self.lock:
+            self.file.truncate(0)
+            self.size = 0
+            self.remap()
+            self.index = {}
+            self.live_size = 0
+
+    def close(self):
+        self.wait_compaction()
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.file.close()
+
+    def __len__(self):
+        return len(self.index)
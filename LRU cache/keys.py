@@ -0,0 +1,110 @@
+import hashlib
+import pickle
+
+"""
+Keys of the cache built from args and kwargs of the call
+"""
+
+
+class KwdMark:
+    """ Separator of args and kwargs in the key (the only instance stays the same after pickling) """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return 'KWD_MARK'
+
+    def __repr__(self):
+        return '<kwargs>'
+
+
+KWD_MARK = KwdMark()
+
+
+def make_key(args: tuple, kwargs: dict, typed: bool = False, hasher=None) -> tuple:
+    """
+    Key of the call: `args` (as is, if there are no kwargs - the fast path) followed by kwargs sorted by name,
+    so `f(1, x=2, y=3)` and `f(1, y=3, x=2)` share the entry. With `typed` types of the arguments are added
+    (`f(1)` and `f(1.0)` are different entries). Unhashable arguments are replaced with `hasher(arg)`
+    """
+    if not kwargs and not typed and hasher is None:
+        return args
+
+    key = args
+    if kwargs:
+        key += (KWD_MARK,)
+        # names are unique, so values are never compared by sorting
+        items = sorted(kwargs.items()) if len(kwargs) > 1 else kwargs.items()
+        for item in items:
+            key += item
+    if typed:
+        key += tuple([type(arg) for arg in args])
+        if kwargs:
+            key += tuple([type(value) for _, value in items])
+    if hasher is not None and not is_hashable(key):
+        # arguments are checked one by one only if there is an unhashable one
+        key = tuple([arg if is_hashable(arg) else hasher(arg) for arg in key])
+    return key
+
+
+def is_hashable(obj) -> bool:
+    try:
+        hash(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def buffer_digest(obj) -> bytes:
+    return hashlib.blake2b(memoryview(obj).tobytes(), digest_size=16).digest()
+
+
+class Frozen:
+    """
+    Hashable replacement of an unhashable argument made by `freeze`: it's equal to other frozen values only,
+    so `f([1])` and `f(('list', (1,)))` are different entries
+    """
+    __slots__ = ('value', 'hash')
+
+    def __init__(self, value: tuple):
+        self.value = value
+        self.hash = hash(value)
+
+    def __eq__(self, other):
+        return type(other) is Frozen and self.hash == other.hash and self.value == other.value
+
+    def __hash__(self):
+        return self.hash
+
+    def __reduce__(self):
+        return Frozen, (self.value,)
+
+    def __repr__(self):
+        return f'Frozen{self.value!r}'
+
+
+def freeze_item(obj):
+    return obj if is_hashable(obj) else freeze(obj)
+
+
+def freeze(obj) -> Frozen:
+    """
+    Default hasher of unhashable arguments: lists, dicts and sets are converted into hashable equivalents,
+    objects supporting the buffer protocol (NumPy arrays, bytearray) are keyed by the digest of their buffer,
+    anything else by the digest of its pickle
+    """
+    if isinstance(obj, (list, tuple)):
+        return Frozen((type(obj).__name__, tuple([freeze_item(arg) for arg in obj])))
+    if isinstance(obj, dict):
+        return Frozen(('dict', frozenset((key, freeze_item(value)) for key, value in obj.items())))
+    if isinstance(obj, set):
+        return Frozen(('set', frozenset(obj)))
+    dtype = getattr(obj, 'dtype', None)
+    if getattr(dtype, 'hasobject', False):
+        # the buffer of an object array holds pointers (equal for different objects once the memory is reused),
+        # so its elements are frozen instead
+        return Frozen((type(obj).__name__, obj.shape, str(dtype), freeze_item(obj.tolist())))
+    try:
+        # NumPy arrays with the same data but different shape/dtype have to be different keys
+        return Frozen((type(obj).__name__, getattr(obj, 'shape', None), str(dtype or ''), buffer_digest(obj)))
+    except TypeError:
+        return Frozen((type(obj).__name__, hashlib.blake2b(pickle.dumps(obj), digest_size=16).digest()))
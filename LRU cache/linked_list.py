@@ -0,0 +1,80 @@
+class Node:
+    """
+    Element of Doubly Linked List
+    """
+    # no per-instance `__dict__`: noticeably less memory per cache entry
+    __slots__ = ('key', 'val', 'next', 'prev', 'owner', 'expires', 'refresh_at', 'weight')
+
+    def __init__(self, key, val):
+        self.key = key
+        self.val = val
+        self.next = None
+        self.prev = None
+        self.owner = None
+        self.expires = None
+        self.refresh_at = None
+        self.weight = 0
+
+
+class LinkedList:
+    """
+    Doubly Linked List with sentinel `head` and `tail` Nodes:
+    Nodes go from the least (after `head`) to the most (before `tail`) recently used one
+    """
+
+    def __init__(self):
+        self.head = Node(0, 0)
+        self.tail = Node(0, 0)
+        self.head.next = self.tail
+        self.tail.prev = self.head
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        current = self.head.next
+        while current is not self.tail:
+            yield current
+            current = current.next
+
+    def append(self, node):
+        """ Add Node to the end of the list """
+        p = self.tail.prev
+        p.next = node
+        self.tail.prev = node
+        node.prev = p
+        node.next = self.tail
+        node.owner = self
+        self.size += 1
+
+    def remove(self, node):
+        """ Remove Node from the list """
+        p = node.prev
+        n = node.next
+        p.next = n
+        n.prev = p
+        self.size -= 1
+
+    def move_to_end(self, node):
+        """ Mark Node as the most recently used one """
+        p = node.prev
+        n = node.next
+        p.next = n
+        n.prev = p
+        p = self.tail.prev
+        p.next = node
+        self.tail.prev = node
+        node.prev = p
+        node.next = self.tail
+
+    def first(self):
+        """ The least recently used Node (None if the list is empty) """
+        node = self.head.next
+        return node if node is not self.tail else None
+
+    def popleft(self):
+        """ Remove and return the least recently used Node """
+        node = self.head.next
+        self.remove(node)
+        return node
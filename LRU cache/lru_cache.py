@@ -1,9 +1,25 @@
+import asyncio
+import atexit
+import inspect
+import pickle
+import sys
+import threading
 import time
 import timeit
-from dataclasses import dataclass, field
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from dataclasses import dataclass, field, replace
 from functools import partial, wraps
 from typing import ClassVar
-from datetime import datetime, timedelta
+
+from disk_tier import MAX_BYTES as DISK_MAX_BYTES, DiskTier
+from keys import freeze, make_key
+from linked_list import Node
+from policies import POLICIES
+from shared_cache import SLOT_SIZE, SharedLRUCache
+from stats import CacheStats, Histogram, prometheus_text
 
 """
 Based on:
@@ -11,151 +27,819 @@ Based on:
 - https://realpython.com/lru-cache-python/#adding-cache-expiration
 """
 
+def deep_getsizeof(obj, seen=None) -> int:
+    """ Size (bytes) of the object together with objects it refers to (containers, `__dict__`, `__slots__`) """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_getsizeof(k, seen) + deep_getsizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_getsizeof(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += deep_getsizeof(vars(obj), seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            size += deep_getsizeof(getattr(obj, slot), seen)
+    return size
+
+
+def entry_weight(key, val) -> int:
+    """ Default weigher of `max_bytes` caches: deep size of the key and the value """
+    return deep_getsizeof(key) + deep_getsizeof(val)
+
+
+# pool of threads that recompute stale entries (created on first use)
+REFRESH_WORKERS = 4
+REFRESH_EXECUTOR = None
+# segments of sharded caches call it under different locks, so the pool is created under its own one
+REFRESH_LOCK = threading.Lock()
+
+
+def refresh_executor() -> ThreadPoolExecutor:
+    global REFRESH_EXECUTOR
+    if REFRESH_EXECUTOR is None:
+        with REFRESH_LOCK:
+            if REFRESH_EXECUTOR is None:
+                REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='lru_refresh')
+    return REFRESH_EXECUTOR
 
-class Node:
-    """
-    Element of Doubly Linked List
-    """
 
-    def __init__(self, key, val):
-        self.key = key
-        self.val = val
-        self.next = None
-        self.prev = None
+# every cache created by `lru_cache` (weak references, so dropped functions disappear from it)
+CACHE_REGISTRY = weakref.WeakSet()
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class LRUCache:
-    """ `Pure` LRUCache (w/o cache TTL) """
+    """
+    `Pure` LRUCache (w/o cache TTL), eviction order is set by `policy` (name from `POLICIES`).
+    `listener(event, key)` (optional) is called on each 'hit', 'miss', 'eviction' (and 'expiration', 'refresh').
+    Keys are built by `make_key`: kwargs don't depend on their order, `typed` separates `f(1)` and `f(1.0)`,
+    `hasher(arg)` makes keys of unhashable arguments (e.g. `freeze`)
+    """
     DEBUG: ClassVar[bool] = False
     func: callable
     max_size: int = 10
-    cache = {}
-    head = Node(0, 0)
-    tail = Node(0, 0)
-    head.next = tail
-    tail.prev = head
-    hits = 0
-    misses = 0
-    current_size = 0
+    max_bytes: int = None
+    weigher: callable = None
+    policy: str = 'lru'
+    listener: callable = None
+    typed: bool = False
+    hasher: callable = None
+    cache: dict = field(default_factory=dict, init=False, repr=False)
+    weight: int = field(default=0, init=False)
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    evictions: int = field(default=0, init=False)
+    current_size: int = field(default=0, init=False)
+    load_time: Histogram = field(default_factory=Histogram, init=False, repr=False)
 
-    def __call__(self, *args, **kwargs):
-        # The cache presents with the help
-        # of Linked List
-        if args in self.cache:
-            self.llist(args)
-            self.hits += 1
+    def __post_init__(self):
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown eviction policy '{self.policy}', expected one of: {', '.join(POLICIES)}")
+        if self.max_size is None and self.policy != 'lru':
+            raise ValueError(f"Eviction policy '{self.policy}' requires `max_size`")
+        if self.max_bytes is not None and self.weigher is None:
+            self.weigher = entry_weight
+        # each instance (i.e. each decorated function) has its own dict and Linked Lists
+        self.clear_cache()
+        CACHE_REGISTRY.add(self)
 
+    def __call__(self, *args, **kwargs):
+        key = make_key(args, kwargs, self.typed, self.hasher)
+        node = self.lookup(key, (args, kwargs))
+        if node is not None:
             if self.DEBUG:
-                cache_list = [f"arg({k})->{v}" for k, v in self.cache.items()]
-                return f"(DEBUG) Hit: {self.func.__name__}({self.cache[args]})\n\t\tCache: {' '.join(cache_list)}\n" \
-                       f"\t\tCacheInfo: hits={self.hits}, misses={self.misses}, maxsize={self.max_size}, " \
-                       f"currsize={self.current_size}"
-            return self.cache[args]
-
-        # The given cache keeps on moving.
-        if self.max_size is not None:
-
-            if len(self.cache) > self.max_size:
-                n = self.head.next
-                self.remove_node(n)
-                del self.cache[n.key]
-
-        # Compute and cache and node to see whether
-        # the following element is present or not
-        # based on the given input.
+                print(self.debug_info('Hit', node.val))
+            return node.val
+
+        # Compute the result first: the function may fill the cache
+        # itself (e.g. recursion), so eviction is done right before insertion
+        start_time = time.perf_counter()
         result = self.func(*args, **kwargs)
-        self.cache[args] = result
-        node = Node(args, result)
-        self.add_note(node)
-        self.misses += 1
-        if self.current_size < self.max_size:
-            self.current_size += 1
+        self.load_time.observe(time.perf_counter() - start_time)
+        self.insert(key, result)
 
         if self.DEBUG:
-            cache_list = [f"arg({k})->{v}" for k, v in self.cache.items()]
-            return f"(DEBUG) Missed: {self.func.__name__}({self.cache[args]})\n\t\tCache: {' '.join(cache_list)}\n" \
-                   f"\t\tCacheInfo: hits={self.hits}, misses={self.misses}, maxsize={self.max_size}, " \
-                   f"current_size={self.current_size}"
+            print(self.debug_info('Missed', result))
         return result
 
-    @staticmethod
-    def remove_node(node):
-        """ Remove Node from double linked list """
-        p = node.prev
-        n = node.next
-        p.next = n
-        n.prev = p
-
-    def add_note(self, node):
-        """ Add Node to double linked list """
-        p = self.tail.prev
-        p.next = node
-        self.tail.prev = node
-        node.prev = p
-        node.next = self.tail
-
-    # Over here the result task is being done
-    def llist(self, args):
-        current = self.head
-
-        while True:
-            if current.key == args:
-                node = current
-                self.remove_node(node)
-                self.add_note(node)
-                if self.DEBUG:
-                    del self.cache[node.key]
-                    self.cache[node.key] = node.val
-                break
+    def get_many(self, keys, loader=None) -> dict:
+        """
+        Values of `func(key)` for each of `keys` (dict key -> value): hits are taken from the cache, all the misses
+        are computed by one call of `loader(missing_keys)` that returns dict key -> value (keys it doesn't return
+        are neither returned nor cached); w/o `loader` the function is called for each missing key
+        """
+        found, missing = self.lookup_many(keys)
+        if missing:
+            start_time = time.perf_counter()
+            loaded = loader(missing) if loader is not None else {key: self.func(key) for key in missing}
+            self.load_time.observe(time.perf_counter() - start_time)
+            self.put_many(loaded)
+            found.update(loaded)
+        return {key: found[key] for key in dict.fromkeys(keys) if key in found}
+
+    def lookup_many(self, keys):
+        """ Values of cached keys (dict) and the list of missing ones """
+        found, missing = {}, []
+        for key in dict.fromkeys(keys):
+            node = self.lookup(make_key((key,), {}, self.typed, self.hasher), ((key,), {}))
+            if node is not None:
+                found[key] = node.val
             else:
-                current = current.next
+                missing.append(key)
+        return found, missing
+
+    def put_many(self, items):
+        """ Cache values of `func(key)` (dict key -> value or pairs) computed elsewhere """
+        for key, val in dict(items).items():
+            self.insert(make_key((key,), {}, self.typed, self.hasher), val)
+
+    def lookup(self, key, call=None):
+        """
+        Node of the key (marked as requested for the eviction policy) or None if it's a miss
+        (`call` - args and kwargs of the call, they are needed to recompute the entry by `TimedLRUCache`)
+        """
+        # The cache maps keys straight to the nodes of the Linked Lists,
+        # so a hit is a dict lookup plus moving the node inside the policy queues
+        node = self.cache.get(key)
+        if node is None:
+            self.misses += 1
+            if self.listener is not None:
+                self.listener('miss', key)
+            return None
+        self.eviction.hit(node)
+        self.hits += 1
+        if self.listener is not None:
+            self.listener('hit', key)
+        return node
+
+    def insert(self, key, val):
+        """ Add computed value to the cache, evicting Nodes chosen by the policy if it's full """
+        node = self.cache.get(key)
+        if node is not None:
+            # the same key has been computed and inserted in the meantime
+            node.val = val
+            if self.weigher is None:
+                self.eviction.hit(node)
+                return node
+            self.weight -= node.weight
+            node.weight = self.weigher(key, val)
+            if self.max_bytes is not None and node.weight > self.max_bytes:
+                # the new value doesn't fit at all: the entry is dropped, as a new one would be rejected
+                self.eviction.remove(node)
+                del self.cache[key]
+                self.current_size = len(self.cache)
+                self.evictions += 1
+                if self.listener is not None:
+                    self.listener('eviction', key)
+                return node
+            self.weight += node.weight
+            self.eviction.hit(node)
+            # the new value may be heavier than the old one
+            while self.is_full():
+                self.evict()
+            self.current_size = len(self.cache)
+            return node
+
+        node = Node(key, val)
+        if self.weigher is not None:
+            node.weight = self.weigher(key, val)
+            if self.max_bytes is not None and node.weight > self.max_bytes:
+                # it would wipe the whole cache and be evicted itself
+                return node
+            self.weight += node.weight
+        self.cache[key] = node
+        self.eviction.insert(node)
+        # the policy may reject the new Node itself (admission)
+        while self.is_full():
+            self.evict()
+        self.current_size = len(self.cache)
+        return node
+
+    def is_full(self) -> bool:
+        """ Whether the cache is over `max_size` entries or over `max_bytes` of total weight """
+        return (self.max_size is not None and len(self.cache) > self.max_size) or \
+            (self.max_bytes is not None and self.weight > self.max_bytes)
+
+    def evict(self):
+        """ Drop the Node chosen by the eviction policy """
+        node = self.eviction.evict()
+        del self.cache[node.key]
+        self.weight -= node.weight
+        self.current_size = len(self.cache)
+        self.evictions += 1
+        if self.listener is not None:
+            self.listener('eviction', node.key)
+        return node
+
+    def nodes(self):
+        """ Iterate over Nodes (queue by queue of the policy, from the least to the most recently used) """
+        for queue in self.eviction.queues:
+            yield from queue
 
-
-@dataclass(kw_only=True)
+    def clear_cache(self):
+        self.cache = {}
+        self.eviction = POLICIES[self.policy](self.max_size)
+        self.current_size = 0
+        self.weight = 0
+
+    def memory_usage(self) -> int:
+        """ Approximate size (bytes) of the dict, Nodes, keys and values of the cache """
+        size = sys.getsizeof(self.cache)
+        for node in self.nodes():
+            size += sys.getsizeof(node)
+            size += sys.getsizeof(node.key) + sys.getsizeof(node.val)
+        return size
+
+    def cache_info(self) -> dict:
+        calls = self.hits + self.misses
+        return {
+            'name': self.func.__qualname__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / calls if calls else 0.0,
+            'max_size': self.max_size,
+            'current_size': self.current_size,
+            'max_bytes': self.max_bytes,
+            'weight': self.weight,
+            'memory': self.memory_usage(),
+        }
+
+    def stats(self) -> CacheStats:
+        """ Snapshot of the statistics (cheap: counters only) """
+        return CacheStats(name=self.func.__qualname__, hits=self.hits, misses=self.misses, evictions=self.evictions,
+                          current_size=self.current_size, max_size=self.max_size, weight=self.weight,
+                          max_bytes=self.max_bytes, load_time=self.load_time.copy())
+
+    def debug_info(self, status, result):
+        cache_list = [f"arg({node.key})->{node.val}" for node in self.nodes()]
+        return f"(DEBUG) {status}: {self.func.__name__}({result})\n\t\tCache: {' '.join(cache_list)}\n" \
+               f"\t\tCacheInfo: hits={self.hits}, misses={self.misses}, maxsize={self.max_size}, " \
+               f"currsize={self.current_size}"
+
+
+@dataclass(kw_only=True, eq=False)
 class TimedLRUCache(LRUCache):
-    """ LRUCache w/ cache TTL """
-    ttl: int = None
+    """
+    LRUCache w/ TTL of each entry: the entry expires `ttl` seconds (monotonic clock) after it was computed,
+    expired entries are dropped lazily (on lookup and on insertion), the cache is never flushed at once.
+    With `disk_path` evicted entries are spilled to the on-disk tier (`DiskTier`, up to `disk_max_bytes` of records)
+    and promoted back on hit; all entries are spilled at exit, so the cache is warm after restart.
+    With `refresh_after` (soft TTL) an older entry is still returned, but it is recomputed in the background
+    (stale-while-revalidate); the refreshed value is put into the cache by the next call of the cache.
+    The function is recomputed in a thread, where its calls of the cache aren't locked, so the cache with
+    `refresh_after` is used by `ShardedLRUCache` only (as its segments)
+    """
+    ttl: float = None
+    refresh_after: float = None
+    disk_path: str = None
+    disk_max_bytes: int = DISK_MAX_BYTES
+    expirations: int = field(default=0, init=False)
+    refreshes: int = field(default=0, init=False)
+    disk_hits: int = field(default=0, init=False)
+    disk: DiskTier = field(default=None, init=False, repr=False)
+    refreshing: set = field(default_factory=set, init=False, repr=False)
+    refreshed: deque = field(default_factory=deque, init=False, repr=False)
 
     def __post_init__(self):
+        super(TimedLRUCache, self).__post_init__()
+        if self.ttl is not None and self.refresh_after is not None and self.refresh_after >= self.ttl:
+            raise ValueError("`refresh_after` has to be less than `ttl`")
+        if self.disk_path is not None:
+            self.disk = DiskTier(self.disk_path, self.disk_max_bytes)
+            atexit.register(self.close)
+
+    def lookup(self, key, call=None):
+        if self.refreshed:
+            self.apply_refreshed()
         if self.ttl is not None:
-            self.lifetime = timedelta(seconds=self.ttl)
-            self.exp_time = datetime.utcnow() + self.lifetime
+            node = self.cache.get(key)
+            if node is not None and node.expires <= time.monotonic():
+                self.expire(node)
+        if self.disk is not None and key not in self.cache:
+            self.promote(key)
+        node = super(TimedLRUCache, self).lookup(key)
+        if node is not None and node.refresh_at is not None and call is not None \
+                and node.refresh_at <= time.monotonic() and key not in self.refreshing:
+            self.refresh(key, call)
+        return node
+
+    def refresh(self, key, call):
+        """ Recompute stale entry in a background thread, the stale value is returned meanwhile """
+        self.refreshing.add(key)
+        args, kwargs = call
+        future = refresh_executor().submit(self.func, *args, **kwargs)
+        # the cache isn't touched from the worker thread: results are applied by `apply_refreshed`
+        future.add_done_callback(lambda done: self.refreshed.append((key, done)))
+
+    def apply_refreshed(self):
+        while self.refreshed:
+            key, future = self.refreshed.popleft()
+            self.refreshing.discard(key)
+            # if recomputing has failed, the stale value stays until `ttl`
+            if future.exception() is None:
+                self.insert(key, future.result())
+                self.refreshes += 1
+                if self.listener is not None:
+                    self.listener('refresh', key)
+
+    def insert(self, key, val):
+        if self.ttl is None and self.refresh_after is None:
+            return super(TimedLRUCache, self).insert(key, val)
+        now = time.monotonic()
+        if self.ttl is not None:
+            self.reap(now)
+        node = super(TimedLRUCache, self).insert(key, val)
+        if self.ttl is not None:
+            node.expires = now + self.ttl
+        if self.refresh_after is not None:
+            node.refresh_at = now + self.refresh_after
+        return node
+
+    def evict(self):
+        node = super(TimedLRUCache, self).evict()
+        if self.disk is not None:
+            self.spill(node)
+        return node
+
+    def spill(self, node):
+        """ Write Node to the disk tier (its expiration is converted to unix time) """
+        expires = 0.0
+        if node.expires is not None:
+            expires = time.time() + (node.expires - time.monotonic())
+        try:
+            self.disk.put(node.key, node.val, expires)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # unpicklable entries are just dropped
+            pass
+
+    def promote(self, key):
+        """ Move the entry from the disk tier back to memory """
+        entry = self.disk.pop(key)
+        if entry is None:
+            return
+        val, expires = entry
+        node = self.insert(key, val)
+        if expires:
+            node.expires = time.monotonic() + (expires - time.time())
+        self.disk_hits += 1
+
+    def close(self):
+        """ Spill all entries to the disk tier and close it """
+        if self.disk is None:
+            return
+        for node in list(self.nodes()):
+            self.spill(node)
+        self.disk.close()
+        self.disk = None
+
+    def clear_cache(self):
+        super(TimedLRUCache, self).clear_cache()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def expire(self, node):
+        """ Drop expired Node """
+        self.eviction.remove(node)
+        del self.cache[node.key]
+        self.weight -= node.weight
+        self.current_size = len(self.cache)
+        self.expirations += 1
+        if self.listener is not None:
+            self.listener('expiration', node.key)
+
+    def reap(self, now):
+        """
+        Drop expired Nodes from the least recently used end of each policy queue, stopping at the first alive one,
+        so the work is proportional to the number of dropped Nodes (the rest are dropped by `lookup` or evicted)
+        """
+        for queue in self.eviction.queues:
+            node = queue.first()
+            while node is not None and node.expires <= now:
+                self.expire(node)
+                node = queue.first()
+
+    def cache_info(self) -> dict:
+        info = super(TimedLRUCache, self).cache_info()
+        info['expirations'] = self.expirations
+        info['refreshes'] = self.refreshes
+        info['disk_hits'] = self.disk_hits
+        info['disk_size'] = len(self.disk) if self.disk is not None else 0
+        return info
+
+    def stats(self) -> CacheStats:
+        return replace(super(TimedLRUCache, self).stats(), expirations=self.expirations, refreshes=self.refreshes)
+
+    def debug_info(self, status, result):
+        return super(TimedLRUCache, self).debug_info(status, result) + f" , ttl={self.ttl}"
+
+
+@dataclass(kw_only=True, eq=False)
+class AsyncLRUCache(TimedLRUCache):
+    """
+    TimedLRUCache for coroutine functions: the awaited result is cached (not the coroutine object),
+    concurrent misses of the same key wait for one in-flight task (single-flight)
+    """
+    in_flight: dict = field(default_factory=dict, init=False, repr=False)
+
+    async def __call__(self, *args, **kwargs):
+        key = make_key(args, kwargs, self.typed, self.hasher)
+        node = self.lookup(key, (args, kwargs))
+        if node is not None:
+            return node.val
+
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.load(key, args, kwargs))
+            self.in_flight[key] = task
+        # cancellation of one of the callers mustn't cancel the computation for the others
+        return await asyncio.shield(task)
+
+    async def get_many(self, keys, loader=None) -> dict:
+        """ `LRUCache.get_many` with a coroutine `loader` (coroutines of the function are gathered w/o it) """
+        found, missing = self.lookup_many(keys)
+        if missing:
+            start_time = time.perf_counter()
+            if loader is not None:
+                loaded = await loader(missing)
+            else:
+                loaded = dict(zip(missing, await asyncio.gather(*(self.func(key) for key in missing))))
+            self.load_time.observe(time.perf_counter() - start_time)
+            self.put_many(loaded)
+            found.update(loaded)
+        return {key: found[key] for key in dict.fromkeys(keys) if key in found}
+
+    def refresh(self, key, call):
+        """ Recompute stale entry in a background task, the stale value is returned meanwhile """
+        if key in self.in_flight:
+            return
+        args, kwargs = call
+        task = asyncio.ensure_future(self.load(key, args, kwargs, refresh=True))
+        self.in_flight[key] = task
+        # if recomputing has failed, the stale value stays until `ttl`
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+    async def load(self, key, args, kwargs, refresh=False):
+        """
+        Await the function and cache its result (exceptions aren't cached);
+        a refresh is counted once it has succeeded, as it is by `TimedLRUCache`
+        """
+        try:
+            start_time = time.perf_counter()
+            result = await self.func(*args, **kwargs)
+            self.load_time.observe(time.perf_counter() - start_time)
+            self.insert(key, result)
+            if refresh:
+                self.refreshes += 1
+                if self.listener is not None:
+                    self.listener('refresh', key)
+            return result
+        finally:
+            del self.in_flight[key]
+
+
+@dataclass(kw_only=True, eq=False)
+class ShardedLRUCache:
+    """
+    Thread-safe TimedLRUCache: keys are spread over `shards` segments, each one with its own lock,
+    so calls that fall into different segments never wait for each other
+    """
+    func: callable
+    max_size: int = 10
+    max_bytes: int = None
+    weigher: callable = None
+    ttl: int = None
+    refresh_after: float = None
+    policy: str = 'lru'
+    disk_path: str = None
+    disk_max_bytes: int = DISK_MAX_BYTES
+    listener: callable = None
+    typed: bool = False
+    hasher: callable = None
+    shards: int = 4
+    segments: list = field(init=False, repr=False)
+    locks: list = field(init=False, repr=False)
+
+    def __post_init__(self):
+        # limits are split between segments (ceil)
+        segment_size = -(-self.max_size // self.shards) if self.max_size is not None else None
+        segment_bytes = -(-self.max_bytes // self.shards) if self.max_bytes is not None else None
+        self.segments = [TimedLRUCache(func=self.func, max_size=segment_size, max_bytes=segment_bytes,
+                                       weigher=self.weigher, ttl=self.ttl, refresh_after=self.refresh_after,
+                                       policy=self.policy, listener=self.listener, typed=self.typed,
+                                       hasher=self.hasher, disk_path=f'{self.disk_path}.{index}' if self.disk_path else None,
+                                       disk_max_bytes=-(-self.disk_max_bytes // self.shards))
+                         for index in range(self.shards)]
+        self.locks = [threading.Lock() for _ in range(self.shards)]
+        # only the whole cache is reported, not its segments
+        for segment in self.segments:
+            CACHE_REGISTRY.discard(segment)
+        CACHE_REGISTRY.add(self)
 
     def __call__(self, *args, **kwargs):
-        if self.ttl is not None:
-            now = datetime.utcnow()
-            if now >= self.exp_time:
-                self.clear_cache()
-                self.exp_time = now + self.lifetime
-        result = super(TimedLRUCache, self).__call__(*args, **kwargs)
-        if self.DEBUG:
-            result += f" , ttl={self.ttl}"
+        key = make_key(args, kwargs, self.typed, self.hasher)
+        index = hash(key) % self.shards
+        segment, lock = self.segments[index], self.locks[index]
+        with lock:
+            node = segment.lookup(key, (args, kwargs))
+            if node is not None:
+                return node.val
+
+        # the lock isn't held while computing: a slow call doesn't block the whole segment
+        start_time = time.perf_counter()
+        result = self.func(*args, **kwargs)
+        duration = time.perf_counter() - start_time
+        with lock:
+            segment.load_time.observe(duration)
+            segment.insert(key, result)
+        return result
+
+    def get_many(self, keys, loader=None) -> dict:
+        """ `LRUCache.get_many`: the lock of each segment is taken once for lookups and once for insertions """
+        keys = list(dict.fromkeys(keys))
+        by_segment = [[] for _ in range(self.shards)]
+        for key in keys:
+            by_segment[hash(make_key((key,), {}, self.typed, self.hasher)) % self.shards].append(key)
+
+        found, missing = {}, []
+        for segment, lock, segment_keys in zip(self.segments, self.locks, by_segment):
+            if segment_keys:
+                with lock:
+                    segment_found, segment_missing = segment.lookup_many(segment_keys)
+                found.update(segment_found)
+                missing += segment_missing
+
+        if missing:
+            start_time = time.perf_counter()
+            loaded = loader(missing) if loader is not None else {key: self.func(key) for key in missing}
+            duration = time.perf_counter() - start_time
+            self.put_many(loaded)
+            # the batch isn't bound to one segment, its load time is counted by the first one
+            with self.locks[0]:
+                self.segments[0].load_time.observe(duration)
+            found.update(loaded)
+        return {key: found[key] for key in keys if key in found}
+
+    def put_many(self, items):
+        by_segment = [{} for _ in range(self.shards)]
+        for key, val in dict(items).items():
+            by_segment[hash(make_key((key,), {}, self.typed, self.hasher)) % self.shards][key] = val
+        for segment, lock, segment_items in zip(self.segments, self.locks, by_segment):
+            if segment_items:
+                with lock:
+                    segment.put_many(segment_items)
+
+    def clear_cache(self):
+        for segment, lock in zip(self.segments, self.locks):
+            with lock:
+                segment.clear_cache()
+
+    def cache_info(self) -> dict:
+        # nodes of each segment are walked (`memory_usage`), so the segment is locked as it is for `stats`
+        infos = []
+        for segment, lock in zip(self.segments, self.locks):
+            with lock:
+                infos.append(segment.cache_info())
+        hits = sum(info['hits'] for info in infos)
+        misses = sum(info['misses'] for info in infos)
+        return {
+            'name': self.func.__qualname__,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+            'max_size': self.max_size,
+            'current_size': sum(info['current_size'] for info in infos),
+            'max_bytes': self.max_bytes,
+            'weight': sum(info['weight'] for info in infos),
+            'expirations': sum(info['expirations'] for info in infos),
+            'refreshes': sum(info['refreshes'] for info in infos),
+            'disk_hits': sum(info['disk_hits'] for info in infos),
+            'disk_size': sum(info['disk_size'] for info in infos),
+            'memory': sum(info['memory'] for info in infos),
+        }
+
+    def stats(self) -> CacheStats:
+        stats_list = []
+        for segment, lock in zip(self.segments, self.locks):
+            with lock:
+                stats_list.append(segment.stats())
+        load_time = Histogram()
+        for stats in stats_list:
+            load_time.merge(stats.load_time)
+        return CacheStats(name=self.func.__qualname__, hits=sum(stats.hits for stats in stats_list),
+                          misses=sum(stats.misses for stats in stats_list),
+                          evictions=sum(stats.evictions for stats in stats_list),
+                          current_size=sum(stats.current_size for stats in stats_list), max_size=self.max_size,
+                          expirations=sum(stats.expirations for stats in stats_list),
+                          refreshes=sum(stats.refreshes for stats in stats_list),
+                          weight=sum(stats.weight for stats in stats_list), max_bytes=self.max_bytes,
+                          load_time=load_time)
+
+
+@dataclass(kw_only=True, eq=False)
+class CompactLRUCache:
+    """
+    Pure LRU cache w/o Node objects: the dict maps keys to slot numbers, keys and values are kept in preallocated
+    lists and links of the slots in preallocated `array('l')` (slot `max_size` is the sentinel: its `next` is
+    the least and its `prev` the most recently used slot). Slots are taken one by one until the cache is full,
+    then the slot of the evicted entry is reused, so nothing is allocated per entry except the dict item
+    """
+    func: callable
+    max_size: int = 10
+    typed: bool = False
+    hasher: callable = None
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    evictions: int = field(default=0, init=False)
+    current_size: int = field(default=0, init=False)
+    load_time: Histogram = field(default_factory=Histogram, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.max_size is None:
+            raise ValueError("Compact cache requires `max_size`")
+        self.clear_cache()
+        CACHE_REGISTRY.add(self)
+
+    def __call__(self, *args, **kwargs):
+        key = make_key(args, kwargs, self.typed, self.hasher)
+        slot = self.cache.get(key)
+        if slot is not None:
+            self.move_to_end(slot)
+            self.hits += 1
+            return self.vals[slot]
+
+        self.misses += 1
+        start_time = time.perf_counter()
+        result = self.func(*args, **kwargs)
+        self.load_time.observe(time.perf_counter() - start_time)
+        slot = self.cache.get(key)
+        if slot is not None:
+            # the function has cached the same key itself (recursion)
+            self.vals[slot] = result
+            self.move_to_end(slot)
+            return result
+
+        if len(self.cache) < self.max_size:
+            slot = len(self.cache)
+        else:
+            slot = self.next[self.max_size]
+            self.unlink(slot)
+            del self.cache[self.keys[slot]]
+            self.evictions += 1
+        self.keys[slot] = key
+        self.vals[slot] = result
+        self.cache[key] = slot
+        self.append(slot)
+        self.current_size = len(self.cache)
         return result
 
+    def unlink(self, slot):
+        p = self.prev[slot]
+        n = self.next[slot]
+        self.next[p] = n
+        self.prev[n] = p
+
+    def append(self, slot):
+        sentinel = self.max_size
+        p = self.prev[sentinel]
+        self.next[p] = slot
+        self.prev[sentinel] = slot
+        self.prev[slot] = p
+        self.next[slot] = sentinel
+
+    def move_to_end(self, slot):
+        self.unlink(slot)
+        self.append(slot)
+
     def clear_cache(self):
+        size = self.max_size
         self.cache = {}
-        self.head = Node(0, 0)
-        self.tail = Node(0, 0)
-        self.head.next = self.tail
-        self.tail.prev = self.head
+        self.keys = [None] * size
+        self.vals = [None] * size
+        self.prev = array('l', [size]) * (size + 1)
+        self.next = array('l', [size]) * (size + 1)
         self.current_size = 0
 
-
-def lru_cache(func=None, *_, max_size=None, ttl=None):
+    def memory_usage(self) -> int:
+        """ Approximate size (bytes) of the dict, arrays, keys and values of the cache """
+        size = sum(sys.getsizeof(obj) for obj in (self.cache, self.keys, self.vals, self.prev, self.next))
+        for key, slot in self.cache.items():
+            size += sys.getsizeof(key) + sys.getsizeof(self.vals[slot])
+        return size
+
+    def cache_info(self) -> dict:
+        calls = self.hits + self.misses
+        return {
+            'name': self.func.__qualname__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / calls if calls else 0.0,
+            'max_size': self.max_size,
+            'current_size': self.current_size,
+            'max_bytes': None,
+            'weight': 0,
+            'memory': self.memory_usage(),
+        }
+
+    def stats(self) -> CacheStats:
+        return CacheStats(name=self.func.__qualname__, hits=self.hits, misses=self.misses, evictions=self.evictions,
+                          current_size=self.current_size, max_size=self.max_size, load_time=self.load_time.copy())
+
+
+def lru_cache(func=None, *_, max_size=None, max_bytes=None, weigher=None, ttl=None, refresh_after=None,
+              shards=None, policy=None, shared=None, slot_size=None, disk_path=None, disk_max_bytes=None, compact=False,
+              listener=None, typed=False, hasher=None):
     """
     additional decorator for calling `TimedLRUCache` with and without parameters
+    (`ShardedLRUCache` if `shards` is passed, for functions called from several threads;
+    `AsyncLRUCache` for `async def` functions; `policy` is one of `POLICIES`: 'lru', '2q', 'arc', 'tinylfu').
+    With `max_bytes` the entries are weighed by `weigher(key, value)` (deep size by default) and the cache
+    isn't limited by the number of entries unless `max_size` is passed too.
+    `shared=True` (or name of the shared memory segment) returns `SharedLRUCache` shared between processes,
+    `slot_size` - its bytes per entry (pickled key and value).
+    `disk_path` adds the persistent on-disk tier (file per shard for `ShardedLRUCache`) limited by `disk_max_bytes`.
+    `compact=True` returns `CompactLRUCache` (array-backed pure LRU, the least memory per entry).
+    `listener(event, key)` is called on each event of the cache (see `LRUCache`).
+    `typed=True` caches arguments of different types separately, `hasher` (`True` for `freeze`) makes keys
+    of unhashable arguments (lists, dicts, NumPy arrays) instead of raising `TypeError`
     """
     if func is None:
-        return partial(lru_cache, max_size=max_size, ttl=ttl)
-    kwargs = {}
-    if max_size is not None:
+        return partial(lru_cache, max_size=max_size, max_bytes=max_bytes, weigher=weigher, ttl=ttl,
+                       refresh_after=refresh_after, shards=shards, policy=policy, shared=shared, slot_size=slot_size,
+                       disk_path=disk_path, disk_max_bytes=disk_max_bytes, compact=compact, listener=listener,
+                       typed=typed, hasher=hasher)
+    if hasher is True:
+        hasher = freeze
+    # parameters supported only by `TimedLRUCache` and its variants
+    timed_params = (max_bytes, weigher, ttl, refresh_after, shards, policy, disk_path, disk_max_bytes, listener)
+    if slot_size is not None and not shared:
+        raise ValueError("`slot_size` can be used only with the shared cache")
+    if compact:
+        if shared or any(param is not None for param in timed_params) or inspect.iscoroutinefunction(func):
+            raise ValueError("Compact cache supports only `max_size` (LRU) and sync functions")
+        return CompactLRUCache(func=func, max_size=max_size or 10, typed=typed, hasher=hasher)
+    if shared:
+        if any(param is not None for param in timed_params) or inspect.iscoroutinefunction(func):
+            raise ValueError("Shared cache supports only `max_size` (LRU) and sync functions")
+        cache = SharedLRUCache(func=func, max_size=max_size or 10, slot_size=slot_size or SLOT_SIZE,
+                               name=shared if isinstance(shared, str) else None, typed=typed, hasher=hasher)
+        CACHE_REGISTRY.add(cache)
+        return cache
+
+    kwargs = {'typed': typed, 'hasher': hasher}
+    if max_size is not None or max_bytes is not None:
         kwargs['max_size'] = max_size
+    if max_bytes is not None:
+        kwargs['max_bytes'] = max_bytes
+    if weigher is not None:
+        kwargs['weigher'] = weigher
     if ttl is not None:
         kwargs['ttl'] = ttl
+    if refresh_after is not None:
+        kwargs['refresh_after'] = refresh_after
+    if policy is not None:
+        kwargs['policy'] = policy
+    if disk_path is not None:
+        kwargs['disk_path'] = disk_path
+    if disk_max_bytes is not None:
+        kwargs['disk_max_bytes'] = disk_max_bytes
+    if listener is not None:
+        kwargs['listener'] = listener
+    if inspect.iscoroutinefunction(func):
+        if shards is not None:
+            raise ValueError("`shards` can't be used with coroutine functions (they run in one thread)")
+        return AsyncLRUCache(func=func, **kwargs)
+    if shards is not None or refresh_after is not None:
+        # stale entries are recomputed by the pool of threads, where the function may call itself (recursion),
+        # so a cache with `refresh_after` has to be thread-safe
+        return ShardedLRUCache(func=func, shards=shards or 1, **kwargs)
     return TimedLRUCache(func=func, **kwargs)
 
 
+def cache_report() -> list[dict]:
+    """ Info (hits, hit ratio, memory) of all caches, the most memory consuming first """
+    return sorted((cache.cache_info() for cache in CACHE_REGISTRY), key=lambda info: info['memory'], reverse=True)
+
+
+def export_prometheus() -> str:
+    """ Statistics of all caches in Prometheus text format (e.g. for the `/metrics` endpoint) """
+    return prometheus_text(cache.stats() for cache in CACHE_REGISTRY)
+
+
+def print_cache_report():
+    for info in cache_report():
+        print(f"{info['name']}: hit_ratio={info['hit_ratio']:.2%}, hits={info['hits']}, misses={info['misses']}, "
+              f"size={info['current_size']}/{info['max_size']}, weight={info['weight']}/{info['max_bytes']} B, "
+              f"memory={info['memory']} B")
+
+
 def example_debug_ttl():
     """ Example with DEBUG output and TTL """
     LRUCache.DEBUG = True
@@ -167,12 +851,31 @@ def example_debug_ttl():
         return n
 
     print(f'\nFunction: ex_func')
-    print(ex_func(1))
-    print(ex_func(2))
-    print(ex_func(3))
-    print(ex_func(1))
-    print(ex_func(3))
-    print(ex_func(4))
+    ex_func(1)
+    ex_func(2)
+    ex_func(3)
+    ex_func(1)
+    ex_func(3)
+    ex_func(4)
+
+
+def example_async_single_flight():
+    """ Example with coroutine function: concurrent calls with the same argument are computed once """
+    LRUCache.DEBUG = False
+
+    @lru_cache(max_size=5, ttl=10)
+    async def slow_lookup(n):
+        print(f'Computing...{n}')
+        await asyncio.sleep(1)
+        return n
+
+    async def run():
+        return await asyncio.gather(*(slow_lookup(n % 2) for n in range(6)))
+
+    print(f'\nFunction: slow_lookup')
+    start_time = timeit.default_timer()
+    print(asyncio.run(run()))
+    print(f'Duration of 6 concurrent calls: {timeit.default_timer() - start_time:.2f} s')
 
 
 def example_fibonacci():
@@ -205,7 +908,11 @@ def example_fibonacci():
     fibonacci_cache(138)
     print(f'Duration of `fibonacci_cache(138)`: {timeit.default_timer() - start_time} s')
 
+    print()
+    print_cache_report()
+
 
 if __name__ == '__main__':
     example_debug_ttl()
+    example_async_single_flight()
     example_fibonacci()
@@ -0,0 +1,236 @@
+from collections import OrderedDict
+
+from linked_list import LinkedList
+
+"""
+Eviction policies of the cache. Each policy keeps resident Nodes in one or more Linked Lists (`queues`)
+and is driven by the cache with the same calls:
+- `insert(node)`: new Node has been added to the cache
+- `hit(node)`: Node has been requested
+- `evict()`: the cache is over its size, choose a victim, unlink it and return it
+- `remove(node)`: Node has been dropped by the cache itself (e.g. expired)
+
+Based on:
+- 2Q: https://www.vldb.org/conf/1994/P439.PDF
+- ARC: https://www.usenix.org/legacy/events/fast03/tech/full_papers/megiddo/megiddo.pdf
+- W-TinyLFU: https://arxiv.org/abs/1512.00727
+"""
+
+
+class LRUPolicy:
+    """ Least Recently Used: one list, the least recently used Node is evicted """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lru = LinkedList()
+        self.queues = (self.lru,)
+
+    def insert(self, node):
+        self.lru.append(node)
+
+    def hit(self, node):
+        self.lru.move_to_end(node)
+
+    def evict(self):
+        return self.lru.popleft()
+
+    def remove(self, node):
+        node.owner.remove(node)
+
+
+class TwoQPolicy:
+    """
+    2Q: new Nodes go to FIFO `a1in`, keys evicted from it are remembered in the ghost queue `a1out`,
+    only a key that comes back while it is in `a1out` gets into the main LRU list `am`.
+    A one-off scan passes through `a1in` and doesn't touch `am`
+    """
+
+    def __init__(self, max_size, in_ratio=0.25, out_ratio=0.5):
+        self.max_size = max_size
+        self.max_in = max(1, int(max_size * in_ratio))
+        self.max_out = max(1, int(max_size * out_ratio))
+        self.a1in = LinkedList()
+        self.am = LinkedList()
+        self.a1out = OrderedDict()
+        self.queues = (self.a1in, self.am)
+
+    def insert(self, node):
+        if node.key in self.a1out:
+            del self.a1out[node.key]
+            self.am.append(node)
+        else:
+            self.a1in.append(node)
+
+    def hit(self, node):
+        # hits in `a1in` are treated as correlated references and don't promote the Node
+        if node.owner is self.am:
+            self.am.move_to_end(node)
+
+    def evict(self):
+        if len(self.a1in) > self.max_in or not self.am:
+            node = self.a1in.popleft()
+            self.a1out[node.key] = None
+            if len(self.a1out) > self.max_out:
+                self.a1out.popitem(last=False)
+            return node
+        return self.am.popleft()
+
+    def remove(self, node):
+        node.owner.remove(node)
+
+
+class ARCPolicy:
+    """
+    Adaptive Replacement Cache: `t1` holds keys seen once recently, `t2` keys seen at least twice,
+    `b1`/`b2` are ghost queues of keys evicted from them. Ghost hits move the target size `p` of `t1`,
+    so the cache adapts between recency and frequency
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.p = 0
+        self.t1 = LinkedList()
+        self.t2 = LinkedList()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self.queues = (self.t1, self.t2)
+        self.new = None
+        self.from_b2 = False
+
+    def insert(self, node):
+        key = node.key
+        self.new = node
+        self.from_b2 = False
+        if key in self.b1:
+            self.p = min(self.max_size, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[key]
+            self.t2.append(node)
+        elif key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[key]
+            self.t2.append(node)
+            self.from_b2 = True
+        else:
+            self.t1.append(node)
+
+    def hit(self, node):
+        node.owner.remove(node)
+        self.t2.append(node)
+
+    def evict(self):
+        # REPLACE(x, p) of the paper, the new Node `x` is already in `t1` or `t2`, so it isn't counted
+        t1_size = len(self.t1) - (self.new is not None and self.new.owner is self.t1)
+        t2_first = self.t2.first()
+        if t1_size and (t1_size > self.p or (self.from_b2 and t1_size == self.p)
+                        or t2_first is None or t2_first is self.new):
+            node = self.t1.popleft()
+            self.b1[node.key] = None
+        else:
+            node = self.t2.popleft()
+            self.b2[node.key] = None
+        self.trim_ghosts()
+        return node
+
+    def trim_ghosts(self):
+        """ Keep |t1| + |b1| <= c and |t1| + |t2| + |b1| + |b2| <= 2c """
+        if len(self.t1) + len(self.b1) > self.max_size and self.b1:
+            self.b1.popitem(last=False)
+        while len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) > 2 * self.max_size and self.b2:
+            self.b2.popitem(last=False)
+
+    def remove(self, node):
+        node.owner.remove(node)
+
+
+class CountMinSketch:
+    """
+    Approximate frequency of keys: 4 rows of counters (max 15), each key increments one counter per row,
+    the estimation is the minimum of them. All counters are halved after `sample_size` increments,
+    so old popularity fades away
+    """
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x85EBCA77C2B2AE63)
+
+    def __init__(self, width):
+        self.width = 1 << max(width - 1, 1).bit_length()
+        self.mask = self.width - 1
+        self.rows = [bytearray(self.width) for _ in self.SEEDS]
+        self.sample_size = 10 * self.width
+        self.additions = 0
+
+    def indexes(self, key):
+        h = hash(key)
+        return [((h * seed) >> 32) & self.mask for seed in self.SEEDS]
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self.indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self.indexes(key)))
+
+    def reset(self):
+        for row in self.rows:
+            row[:] = bytes(counter >> 1 for counter in row)
+        self.additions //= 2
+
+
+class TinyLFUPolicy:
+    """
+    W-TinyLFU: new Nodes go to a small LRU `window`, Nodes pushed out of it become candidates for
+    the main segmented LRU (`probation` + `protected`). A candidate is admitted only if its estimated
+    frequency is higher than the frequency of the main victim, so one-off keys of a scan are rejected
+    """
+
+    def __init__(self, max_size, window_ratio=0.01, protected_ratio=0.8):
+        self.max_size = max_size
+        self.max_window = max(1, int(max_size * window_ratio))
+        self.max_protected = max(1, int((max_size - self.max_window) * protected_ratio))
+        self.window = LinkedList()
+        self.probation = LinkedList()
+        self.protected = LinkedList()
+        self.queues = (self.window, self.probation, self.protected)
+        self.sketch = CountMinSketch(max_size)
+        self.candidate = None
+
+    def insert(self, node):
+        self.sketch.increment(node.key)
+        self.window.append(node)
+        if len(self.window) > self.max_window:
+            self.candidate = self.window.popleft()
+            self.probation.append(self.candidate)
+
+    def hit(self, node):
+        self.sketch.increment(node.key)
+        if node.owner is self.probation:
+            self.probation.remove(node)
+            self.protected.append(node)
+            if len(self.protected) > self.max_protected:
+                self.probation.append(self.protected.popleft())
+        else:
+            node.owner.move_to_end(node)
+
+    def evict(self):
+        victim = self.probation.first() or self.protected.first() or self.window.first()
+        candidate, self.candidate = self.candidate, None
+        if candidate is not None and candidate is not victim and candidate.owner is self.probation:
+            if self.sketch.estimate(candidate.key) <= self.sketch.estimate(victim.key):
+                victim = candidate
+        victim.owner.remove(victim)
+        return victim
+
+    def remove(self, node):
+        node.owner.remove(node)
+        if node is self.candidate:
+            self.candidate = None
+
+
+POLICIES = {
+    'lru': LRUPolicy,
+    '2q': TwoQPolicy,
+    'arc': ARCPolicy,
+    'tinylfu': TinyLFUPolicy,
+}
@@ -0,0 +1,344 @@
+import atexit
+import fcntl
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from multiprocessing import resource_tracker, shared_memory
+
+from keys import make_key
+from stats import CacheStats, Histogram
+
+"""
+LRU cache kept in a `multiprocessing.shared_memory` segment, so all worker processes of a host share one warm cache.
+
+Layout of the segment (all numbers are int64):
+- header: fields below (`H_*`)
+- buckets: hash index, head slot of the chain of each bucket (-1 if empty)
+- slots: `S_*` fields of each slot (LRU links, next slot in the bucket chain, hash and lengths of the entry)
+- data: `slot_size` bytes of each slot with the pickled key followed by the pickled value
+Free slots are linked into a list with the `S_NEXT` field.
+"""
+
+MAGIC = 0x4C5255434143  # 'LRUCAC'
+EMPTY = -1
+
+(H_MAGIC, H_CAPACITY, H_SLOT_SIZE, H_BUCKETS, H_COUNT, H_HEAD, H_TAIL, H_FREE,
+ H_HITS, H_MISSES, H_EVICTIONS, H_WEIGHT, H_REJECTED) = range(13)
+HEADER_FIELDS = 16
+
+S_PREV, S_NEXT, S_CHAIN, S_HASH, S_KEY_LEN, S_VAL_LEN = range(6)
+SLOT_FIELDS = 6
+
+INT = 8  # bytes of int64
+# default bytes of a slot (pickled key and value of one entry)
+SLOT_SIZE = 1024
+
+
+def key_hash(key: bytes) -> int:
+    """ Hash of pickled key that is the same in all processes (unlike `hash()` of str/bytes) """
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') >> 1
+
+
+def attach_segment(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach the existing segment w/o leaving it in the resource tracker of this process: the segment is owned
+    (and unlinked) by the process that has created it. A worker forked or spawned by the creator shares its tracker,
+    so the registration is kept there (unregistering it would remove the creator's one); a tracker started by
+    this process would unlink the segment at exit, so it's unregistered
+    """
+    try:
+        # Python 3.13+
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    own_tracker = resource_tracker._resource_tracker._fd is None
+    shm = shared_memory.SharedMemory(name=name)
+    if own_tracker:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+@dataclass(kw_only=True, eq=False)
+class SharedLRUCache:
+    """
+    LRU cache shared between processes: entries (pickled keys and values up to `slot_size` bytes in total)
+    are stored in the shared memory segment `name`; larger entries aren't cached (counted as `rejected`).
+    The cache has to be created before the workers are forked,
+    or created/attached with the same `name` in each process (the first one creates the segment).
+    Access is serialized by a lock of the file `<tmp>/<name>.lock` (`lockf`, so forked processes don't share it)
+    """
+    func: callable
+    max_size: int = 10
+    slot_size: int = SLOT_SIZE
+    name: str = None
+    typed: bool = False
+    hasher: callable = None
+    shm: shared_memory.SharedMemory = field(init=False, repr=False)
+    created: bool = field(default=False, init=False)
+    closed: bool = field(default=False, init=False)
+    # load times of this process only (counters are shared)
+    load_time: Histogram = field(default_factory=Histogram, init=False, repr=False)
+
+    def __post_init__(self):
+        # an auto-named segment is private to the process that creates it (and its forked workers)
+        self.private = self.name is None
+        self.owner_pid = os.getpid()
+        if self.private:
+            self.name = f'lru_{os.getpid()}_{id(self):x}'
+        self.buckets_number = 2 * self.max_size
+        self.thread_lock = threading.Lock()
+        self.lock_fd = os.open(os.path.join(tempfile.gettempdir(), f'{self.name}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+
+        size = (HEADER_FIELDS + self.buckets_number + SLOT_FIELDS * self.max_size) * INT \
+            + self.max_size * self.slot_size
+        with self.locked():
+            try:
+                self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+                self.created = True
+            except FileExistsError:
+                self.shm = attach_segment(self.name)
+            self.map_segment()
+            if self.created:
+                self.init_segment()
+            elif (self.header[H_MAGIC], self.header[H_CAPACITY], self.header[H_SLOT_SIZE]) != \
+                    (MAGIC, self.max_size, self.slot_size):
+                self.close()
+                raise ValueError(f"Shared memory '{self.name}' has been created with other `max_size`/`slot_size`")
+        atexit.register(self.close_at_exit)
+
+    def map_segment(self):
+        buf = self.shm.buf
+        start, end = 0, HEADER_FIELDS * INT
+        self.header = buf[start:end].cast('q')
+        start, end = end, end + self.buckets_number * INT
+        self.buckets_offset = start
+        self.buckets = buf[start:end].cast('q')
+        start, end = end, end + SLOT_FIELDS * self.max_size * INT
+        self.slots = buf[start:end].cast('q')
+        self.data = buf[end:end + self.max_size * self.slot_size]
+
+    def init_segment(self):
+        header = self.header
+        header[H_CAPACITY] = self.max_size
+        header[H_SLOT_SIZE] = self.slot_size
+        header[H_BUCKETS] = self.buckets_number
+        header[H_HEAD] = header[H_TAIL] = EMPTY
+        header[H_COUNT] = header[H_WEIGHT] = header[H_REJECTED] = 0
+        # all bytes 0xff == int64 -1
+        self.shm.buf[self.buckets_offset:self.buckets_offset + self.buckets_number * INT] = \
+            b'\xff' * (self.buckets_number * INT)
+        for slot in range(self.max_size):
+            self.slots[slot * SLOT_FIELDS + S_NEXT] = slot + 1 if slot + 1 < self.max_size else EMPTY
+        header[H_FREE] = 0 if self.max_size else EMPTY
+        header[H_MAGIC] = MAGIC
+
+    @contextmanager
+    def locked(self):
+        with self.thread_lock:
+            fcntl.lockf(self.lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.lock_fd, fcntl.LOCK_UN)
+
+    def __call__(self, *args, **kwargs):
+        key = pickle.dumps(make_key(args, kwargs, self.typed, self.hasher), protocol=pickle.HIGHEST_PROTOCOL)
+        h = key_hash(key)
+        with self.locked():
+            val = self.get(key, h)
+        if val is not None:
+            return pickle.loads(val)
+
+        # the lock isn't held while computing
+        start_time = time.perf_counter()
+        result = self.func(*args, **kwargs)
+        self.load_time.observe(time.perf_counter() - start_time)
+        with self.locked():
+            self.put(key, h, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        return result
+
+    def get_many(self, keys, loader=None) -> dict:
+        """ `LRUCache.get_many`: the lock is taken once for lookups and once for insertions """
+        keys = list(dict.fromkeys(keys))
+        pickled = {key: pickle.dumps(make_key((key,), {}, self.typed, self.hasher), protocol=pickle.HIGHEST_PROTOCOL)
+                   for key in keys}
+        with self.locked():
+            vals = {key: self.get(pickled_key, key_hash(pickled_key)) for key, pickled_key in pickled.items()}
+        found = {key: pickle.loads(val) for key, val in vals.items() if val is not None}
+        missing = [key for key in keys if key not in found]
+
+        if missing:
+            start_time = time.perf_counter()
+            loaded = loader(missing) if loader is not None else {key: self.func(key) for key in missing}
+            self.load_time.observe(time.perf_counter() - start_time)
+            self.put_many(loaded)
+            found.update(loaded)
+        return {key: found[key] for key in keys if key in found}
+
+    def put_many(self, items):
+        entries = []
+        for key, val in dict(items).items():
+            pickled_key = pickle.dumps(make_key((key,), {}, self.typed, self.hasher), protocol=pickle.HIGHEST_PROTOCOL)
+            entries.append((pickled_key, key_hash(pickled_key), pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)))
+        with self.locked():
+            for pickled_key, h, val in entries:
+                self.put(pickled_key, h, val)
+
+    def find(self, key: bytes, h: int) -> int:
+        """ Slot of the key (EMPTY if it isn't cached) """
+        slots, data, size = self.slots, self.data, self.slot_size
+        slot = self.buckets[h % self.buckets_number]
+        while slot != EMPTY:
+            base = slot * SLOT_FIELDS
+            if slots[base + S_HASH] == h and slots[base + S_KEY_LEN] == len(key) \
+                    and data[slot * size:slot * size + len(key)] == key:
+                return slot
+            slot = slots[base + S_CHAIN]
+        return EMPTY
+
+    def get(self, key: bytes, h: int):
+        """ Pickled value of the key (marked as the most recently used) or None if it's a miss """
+        slot = self.find(key, h)
+        if slot == EMPTY:
+            self.header[H_MISSES] += 1
+            return None
+        self.header[H_HITS] += 1
+        self.unlink_lru(slot)
+        self.append_lru(slot)
+        start = slot * self.slot_size + len(key)
+        return bytes(self.data[start:start + self.slots[slot * SLOT_FIELDS + S_VAL_LEN]])
+
+    def put(self, key: bytes, h: int, val: bytes):
+        """ Store pickled value in the slot of the key (a new one or the least recently used one) """
+        if len(key) + len(val) > self.slot_size or not self.max_size:
+            self.header[H_REJECTED] += 1
+            return
+
+        slot = self.find(key, h)
+        if slot != EMPTY:
+            # the same key has been computed and inserted by another worker in the meantime
+            self.unlink_lru(slot)
+            self.header[H_WEIGHT] -= self.slots[slot * SLOT_FIELDS + S_VAL_LEN]
+        else:
+            if self.header[H_FREE] == EMPTY:
+                self.evict()
+            slot = self.header[H_FREE]
+            base = slot * SLOT_FIELDS
+            self.header[H_FREE] = self.slots[base + S_NEXT]
+            bucket = h % self.buckets_number
+            self.slots[base + S_CHAIN] = self.buckets[bucket]
+            self.buckets[bucket] = slot
+            self.slots[base + S_HASH] = h
+            self.slots[base + S_KEY_LEN] = len(key)
+            self.header[H_COUNT] += 1
+            self.header[H_WEIGHT] += len(key)
+
+        self.slots[slot * SLOT_FIELDS + S_VAL_LEN] = len(val)
+        self.header[H_WEIGHT] += len(val)
+        start = slot * self.slot_size
+        self.data[start:start + len(key) + len(val)] = key + val
+        self.append_lru(slot)
+
+    def evict(self):
+        """ Free the least recently used slot """
+        slots = self.slots
+        slot = self.header[H_HEAD]
+        base = slot * SLOT_FIELDS
+        self.unlink_lru(slot)
+
+        bucket = slots[base + S_HASH] % self.buckets_number
+        current, previous = self.buckets[bucket], EMPTY
+        while current != slot:
+            current, previous = slots[current * SLOT_FIELDS + S_CHAIN], current
+        if previous == EMPTY:
+            self.buckets[bucket] = slots[base + S_CHAIN]
+        else:
+            slots[previous * SLOT_FIELDS + S_CHAIN] = slots[base + S_CHAIN]
+
+        slots[base + S_NEXT] = self.header[H_FREE]
+        self.header[H_FREE] = slot
+        self.header[H_COUNT] -= 1
+        self.header[H_WEIGHT] -= slots[base + S_KEY_LEN] + slots[base + S_VAL_LEN]
+        self.header[H_EVICTIONS] += 1
+
+    def unlink_lru(self, slot: int):
+        slots, header = self.slots, self.header
+        p, n = slots[slot * SLOT_FIELDS + S_PREV], slots[slot * SLOT_FIELDS + S_NEXT]
+        if p == EMPTY:
+            header[H_HEAD] = n
+        else:
+            slots[p * SLOT_FIELDS + S_NEXT] = n
+        if n == EMPTY:
+            header[H_TAIL] = p
+        else:
+            slots[n * SLOT_FIELDS + S_PREV] = p
+
+    def append_lru(self, slot: int):
+        slots, header = self.slots, self.header
+        tail = header[H_TAIL]
+        slots[slot * SLOT_FIELDS + S_PREV] = tail
+        slots[slot * SLOT_FIELDS + S_NEXT] = EMPTY
+        if tail == EMPTY:
+            header[H_HEAD] = slot
+        else:
+            slots[tail * SLOT_FIELDS + S_NEXT] = slot
+        header[H_TAIL] = slot
+
+    def clear_cache(self):
+        with self.locked():
+            self.init_segment()
+
+    def cache_info(self) -> dict:
+        with self.locked():
+            hits, misses = self.header[H_HITS], self.header[H_MISSES]
+            count, weight, rejected = self.header[H_COUNT], self.header[H_WEIGHT], self.header[H_REJECTED]
+        return {
+            'name': self.func.__qualname__,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+            'max_size': self.max_size,
+            'current_size': count,
+            'max_bytes': self.max_size * self.slot_size,
+            'weight': weight,
+            'rejected': rejected,
+            'memory': self.shm.size,
+        }
+
+    def stats(self) -> CacheStats:
+        with self.locked():
+            header = self.header
+            return CacheStats(name=self.func.__qualname__, hits=header[H_HITS], misses=header[H_MISSES],
+                              evictions=header[H_EVICTIONS], current_size=header[H_COUNT], max_size=self.max_size,
+                              weight=header[H_WEIGHT], max_bytes=self.max_size * self.slot_size,
+                              rejected=header[H_REJECTED], load_time=self.load_time.copy())
+
+    def close(self):
+        """ Detach the segment from this process (views of the segment are released, otherwise it can't be closed) """
+        if self.closed:
+            return
+        self.closed = True
+        for view in (self.header, self.buckets, self.slots, self.data):
+            view.release()
+        self.shm.close()
+        os.close(self.lock_fd)
+
+    def unlink(self):
+        """ Destroy the segment (to be called once, by the process that has created it) """
+        self.close()
+        self.shm.unlink()
+        os.unlink(os.path.join(tempfile.gettempdir(), f'{self.name}.lock'))
+
+    def close_at_exit(self):
+        """ Detach the segment at exit, the creator of an auto-named segment destroys it with its lock file """
+        if self.closed:
+            return
+        if self.private and self.created and os.getpid() == self.owner_pid:
+            self.unlink()
+        else:
+            self.close()
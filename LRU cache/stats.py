@@ -0,0 +1,112 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+"""
+Statistics of caches: snapshot `CacheStats` (returned by `stats()` of a cache), histogram of load times
+(time of computing the function on a miss) and export of statistics in Prometheus text format
+"""
+
+# upper bounds (seconds) of the buckets of load time histogram
+LOAD_TIME_BOUNDS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Histogram:
+    """ Counts of observed values in buckets with fixed upper bounds (the last bucket is +Inf) """
+
+    def __init__(self, bounds=LOAD_TIME_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def copy(self):
+        histogram = Histogram(self.bounds)
+        histogram.merge(self)
+        return histogram
+
+    def quantile(self, q):
+        """ Upper bound of the bucket that contains `q`-quantile (inf if it's in the last bucket) """
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    """ Snapshot of the statistics of one cache """
+    name: str
+    hits: int
+    misses: int
+    evictions: int
+    current_size: int
+    max_size: int = None
+    expirations: int = 0
+    refreshes: int = 0
+    weight: int = 0
+    max_bytes: int = None
+    # entries that haven't been cached because they don't fit (e.g. into a slot of the shared cache)
+    rejected: int = 0
+    load_time: Histogram = field(default_factory=Histogram, compare=False, repr=False)
+
+    @property
+    def hit_ratio(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(stats_list) -> str:
+    """ Statistics of caches in Prometheus text exposition format """
+    metrics = (
+        ('hits_total', 'counter', 'Cache hits', 'hits'),
+        ('misses_total', 'counter', 'Cache misses', 'misses'),
+        ('evictions_total', 'counter', 'Entries evicted by the eviction policy', 'evictions'),
+        ('expirations_total', 'counter', 'Entries dropped after TTL', 'expirations'),
+        ('refreshes_total', 'counter', 'Entries recomputed in the background', 'refreshes'),
+        ('rejected_total', 'counter', 'Entries not cached because they do not fit', 'rejected'),
+        ('size', 'gauge', 'Current number of entries', 'current_size'),
+        ('weight_bytes', 'gauge', 'Current total weight of entries', 'weight'),
+    )
+    stats_list = list(stats_list)
+    # label values have to be unique (e.g. several lambdas)
+    names, seen = [], {}
+    for stats in stats_list:
+        seen[stats.name] = seen.get(stats.name, 0) + 1
+        names.append(escape_label(stats.name if seen[stats.name] == 1 else f'{stats.name}#{seen[stats.name]}'))
+
+    lines = []
+    for metric, metric_type, description, attr in metrics:
+        lines.append(f'# HELP lru_cache_{metric} {description}')
+        lines.append(f'# TYPE lru_cache_{metric} {metric_type}')
+        for name, stats in zip(names, stats_list):
+            lines.append(f'lru_cache_{metric}{{cache="{name}"}} {getattr(stats, attr)}')
+
+    lines.append('# HELP lru_cache_load_seconds Time of computing the function on a miss')
+    lines.append('# TYPE lru_cache_load_seconds histogram')
+    for name, stats in zip(names, stats_list):
+        histogram, cumulative = stats.load_time, 0
+        for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f'lru_cache_load_seconds_bucket{{cache="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'lru_cache_load_seconds_sum{{cache="{name}"}} {histogram.sum}')
+        lines.append(f'lru_cache_load_seconds_count{{cache="{name}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
@@ -1,3 +1,4 @@
+import re
 import sys
 from pathlib import Path
 
@@ -32,6 +33,26 @@ EXTENSIONS_DICT = {
     'ARCHIVES': ('zip', 'tar', 'gztar')
 }
 
+# extension -> type of file (built once, so the type is found by one dict lookup)
+EXTENSION_TYPES = {ext: file_type for file_type, extensions in EXTENSIONS_DICT.items() for ext in extensions}
+
+# magic numbers (regex of the beginning of the file) of each type, they are checked in this order
+# for files with a missing or unknown extension
+# (there are no archives: zip is the container of odt, jar, epub, xlsx... and only files with an archive extension
+# are extracted, the rest are moved as is)
+MAGIC_NUMBERS = (
+    ('DOCUMENTS', rb'PK\x03\x04.{26}\[Content_Types\]\.xml'),  # docx, xlsx... (zip with Office content)
+    ('DOCUMENTS', rb'%PDF-|\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1|\{\\rtf'),
+    ('IMAGES', rb'\xff\xd8\xff|\x89PNG\r\n\x1a\n|GIF8[79]a|RIFF.{4}WEBP|.{4}ftyp(?:heic|heix|mif1|avif)'),
+    ('AUDIO', rb'ID3|\xff[\xfb\xf3\xf2]|RIFF.{4}WAVE|fLaC|OggS|.{4}ftypM4A'),
+    ('VIDEO', rb'.{4}ftyp|\x1a\x45\xdf\xa3|RIFF.{4}AVI '),
+)
+# bytes read from the beginning of a file to find its type
+MAGIC_SIZE = 512
+# all the magic numbers in one regex: the name of the matched group is `<type>_<index>`
+MAGIC = re.compile(b'|'.join(b'(?P<%s_%d>%s)' % (file_type.encode(), index, pattern)
+                             for index, (file_type, pattern) in enumerate(MAGIC_NUMBERS)), re.DOTALL)
+
 FOLDERS = []
 EXTENSIONS = set()
 UNKNOWN = set()
@@ -42,6 +63,18 @@ def get_extension(filename: str) -> str:
     return Path(filename).suffix[1:].lower()  # just changed to lower()
 
 
+def sniff(path: Path) -> str | None:
+    """
+    Type of the file by the magic number in its first `MAGIC_SIZE` bytes (None if it's unknown)
+    """
+    try:
+        with open(path, 'rb') as file:
+            match = MAGIC.match(file.read(MAGIC_SIZE))
+    except OSError:
+        return None
+    return match.lastgroup.rsplit('_', 1)[0] if match else None
+
+
 def scan(folder: Path) -> None:
     """
     Scans the folder and fill containers with files names sorted by their type,
@@ -61,23 +94,21 @@ def scan(folder: Path) -> None:
         #  Пошла работа с файлом
         ext = get_extension(item.name)  # взять расширение
         fullname = folder / item.name  # взять полный путь к файлу
-        if not ext:  # если у файла нет расширения добавить к неизвестным
-            OTHER.append(fullname)
+        file_type = EXTENSION_TYPES.get(ext)
+        if file_type is not None:
+            EXTENSIONS.add(ext)
         else:
-            for k, v in EXTENSIONS_DICT.items():
-                # at first choose type of extention
-                if ext in v:
-                    # then choose proper contaner
-                    container = EXTENSIONS_CONT[k]
-                    EXTENSIONS.add(ext)
-                    container.append(fullname)
-                    break
-            else:
+            if ext:
                 # Если мы не регистрировали расширение в REGISTER_EXTENSIONS, то добавить в другое
                 UNKNOWN.add(ext)
-                OTHER.append(fullname)
-                # save folder that contain file with type OTHER
-                FOLDERS_UNKNOWN.append(item.parent.absolute())
+            # если у файла нет (известного) расширения, тип определяется по его первым байтам
+            file_type = sniff(fullname)
+        if file_type is not None:
+            EXTENSIONS_CONT[file_type].append(fullname)
+        else:
+            OTHER.append(fullname)
+            # save folder that contain file with type OTHER
+            FOLDERS_UNKNOWN.append(item.parent.absolute())
 
 
 if __name__ == '__main__':
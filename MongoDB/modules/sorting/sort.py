@@ -1,24 +1,41 @@
 import shutil
 import sys
+import threading
 from pathlib import Path
 
 from . import file_parser as parser
 from .normalize import normalize
 
 
+# target folders created by the current sorting: each one is created once instead of a `mkdir` per file
+CREATED_FOLDERS = set()
+FOLDERS_LOCK = threading.Lock()
+
+
+def make_folder(folder: Path) -> None:
+    """ Create the folder if it hasn't been created yet (the set is checked again under the lock) """
+    key = str(folder)
+    if key in CREATED_FOLDERS:
+        return
+    with FOLDERS_LOCK:
+        if key not in CREATED_FOLDERS:
+            folder.mkdir(exist_ok=True, parents=True)
+            CREATED_FOLDERS.add(key)
+
+
 def handle_media(filename: Path, target_folder: Path) -> None:
-    target_folder.mkdir(exist_ok=True, parents=True)
+    make_folder(target_folder)
     filename.replace(target_folder / normalize(filename.name))
 
 
 def handle_other(filename: Path, target_folder: Path) -> None:
-    target_folder.mkdir(exist_ok=True, parents=True)
+    make_folder(target_folder)
     filename.replace(target_folder / normalize(filename.name))
 
 
 def handle_archive(filename: Path, target_folder: Path) -> None:
     # Создаем папку для архивов
-    target_folder.mkdir(exist_ok=True, parents=True)
+    make_folder(target_folder)
     # Создаем папку куда распаковываем архив
     # берем суффикс у файла и убираем replace(filename.suffix, '')
     folder_for_file = target_folder / \
@@ -44,6 +61,8 @@ def handle_folder(folder: Path) -> None:
 
 
 def main(folder: Path) -> None:
+    # folders may have been deleted since the last sorting
+    CREATED_FOLDERS.clear()
     parser.scan(folder)
 
     for file in parser.IMAGES:
@@ -0,0 +1,73 @@
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aiopath import AsyncPath
+
+import file_parser as parser
+from main import start_async
+from mover import forget_folders, make_folder
+
+"""
+Syscall-count benchmark of creating target folders: `mkdir` calls are counted by an audit hook (`os.mkdir` event
+is raised by each call, from any thread), so no `strace` is needed
+"""
+
+TYPES = ('images', 'video', 'documents', 'audio', 'OTHER_TYPES', 'archives')
+SUFFIXES = ('.jpg', '.mp4', '.txt', '.mp3', '.xyz')
+MKDIR_CALLS = []
+
+
+def count_mkdir(event, args):
+    if event == 'os.mkdir':
+        # `append` is atomic, so calls from threads aren't lost
+        MKDIR_CALLS.append(args[0])
+
+
+def benchmark_mkdir(files=100_000):
+    """ `mkdir` per file (as each handler did) vs the set of created folders, for files spread over the six types """
+    print(f'\nCreating target folders ({files} files, {len(TYPES)} folders)')
+    with tempfile.TemporaryDirectory() as root:
+        folders = [Path(root) / 'per_file' / TYPES[n % len(TYPES)] for n in range(files)]
+        MKDIR_CALLS.clear()
+        start = time.perf_counter()
+        for folder in folders:
+            folder.mkdir(exist_ok=True, parents=True)
+        print(f'mkdir per file: {len(MKDIR_CALLS):>7} mkdir calls, {(time.perf_counter() - start) * 1000:7.1f} ms')
+
+        folders = [Path(root) / 'cached' / TYPES[n % len(TYPES)] for n in range(files)]
+        forget_folders()
+        MKDIR_CALLS.clear()
+        start = time.perf_counter()
+        for folder in folders:
+            make_folder(folder)
+        print(f'created once:   {len(MKDIR_CALLS):>7} mkdir calls, {(time.perf_counter() - start) * 1000:7.1f} ms')
+
+
+def make_tree(root: Path, files: int, per_folder: int = 100) -> None:
+    for n in range(files):
+        folder = root / f'folder_{n // per_folder}'
+        if n % per_folder == 0:
+            folder.mkdir(parents=True)
+        (folder / f'file_{n}{SUFFIXES[n % len(SUFFIXES)]}').touch()
+
+
+def benchmark_sorting(files=10_000, copiers_number=5):
+    """ `mkdir` calls of a whole sorting run by `copiers_number` concurrent copiers """
+    print(f'\nSorting {files} files by {copiers_number} copiers')
+    with tempfile.TemporaryDirectory() as root:
+        sort_folder = Path(root) / 'sort'
+        make_tree(sort_folder, files)
+        parser.FOLDERS = []
+        MKDIR_CALLS.clear()
+        asyncio.run(start_async(AsyncPath(sort_folder), copiers_number))
+        created = sorted({Path(path).name for path in MKDIR_CALLS})
+        print(f'{len(MKDIR_CALLS)} mkdir calls for {files} files (one per file before), folders: {", ".join(created)}')
+
+
+if __name__ == '__main__':
+    sys.addaudithook(count_mkdir)
+    benchmark_mkdir()
+    benchmark_sorting()
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+# bytes hashed to compare files of the same size before hashing their whole content
+PARTIAL_SIZE = 64 * 1024
+CHUNK_SIZE = 1 << 20
+
+
+def partial_hash(path: Path) -> bytes:
+    with open(path, 'rb') as file:
+        return hashlib.blake2b(file.read(PARTIAL_SIZE)).digest()
+
+
+def full_hash(path: Path) -> bytes:
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class Candidate:
+    """
+    Kept file: its path after sorting (None if it's gone, e.g. an extracted archive) and hashes computed on demand
+    (hashes of a new file computed while it's compared are kept when it becomes a kept file)
+    """
+    __slots__ = ('path', 'partial', 'full')
+
+    def __init__(self, path: Path = None):
+        self.path = path
+        self.partial = None
+        self.full = None
+
+
+class Deduplicator:
+    """
+    Finds exact duplicates among sorted files: files are grouped by size, files of the same size are compared by the hash
+    of their first `PARTIAL_SIZE` bytes and only then by the hash of the whole content (computed in the pool
+    of processes), so the hashing cost is proportional to the number of files that may be duplicates.
+    `mode` - what is done with a duplicate: 'delete' (it's deleted) or 'link' (a hard link to the kept copy is created
+    in its place, so the name is still there)
+    """
+    MODES = ('delete', 'link')
+
+    def __init__(self, mode: str = 'delete', pool: Executor = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown dedup mode '{mode}', expected one of: {', '.join(self.MODES)}")
+        self.mode = mode
+        self.pool = pool
+        self.by_size = defaultdict(list)
+        # files of the same size are handled one by one, otherwise two copies may be kept both;
+        # a lock (with the number of its users) exists only while files of its size are handled
+        self.locks = {}
+        self.duplicates = 0
+        self.saved = 0
+
+    @asynccontextmanager
+    async def lock(self, size: int):
+        entry = self.locks.get(size)
+        if entry is None:
+            entry = self.locks[size] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[size]
+
+    async def hash_candidate(self, candidate: Candidate, path: Path, size: int, full: bool = False) -> None:
+        """ Compute missing hashes of the file (the full one only if it's asked and it differs from the partial one) """
+        if candidate.partial is None:
+            candidate.partial = await asyncio.to_thread(partial_hash, path)
+        if full and candidate.full is None and size > PARTIAL_SIZE:
+            loop = asyncio.get_running_loop()
+            candidate.full = await loop.run_in_executor(self.pool, full_hash, path)
+
+    async def find_original(self, path: Path, size: int) -> tuple[Candidate | None, Candidate]:
+        """
+        Kept file with the same content as the file (None if the file is unique) and the candidate of the file
+        with the hashes computed for the comparison (to be added if the file is kept)
+        """
+        new = Candidate(path)
+        candidates = self.by_size.get(size)
+        if not candidates:
+            return None, new
+        await self.hash_candidate(new, path, size)
+        for candidate in candidates:
+            try:
+                if candidate.path is not None:
+                    await self.hash_candidate(candidate, candidate.path, size)
+                if candidate.partial != new.partial:
+                    continue
+                if candidate.path is not None:
+                    await self.hash_candidate(candidate, candidate.path, size, full=True)
+                await self.hash_candidate(new, path, size, full=True)
+            except OSError:
+                # the kept file has been removed or renamed
+                continue
+            if candidate.full == new.full:
+                return candidate, new
+        return None, new
+
+    def add(self, candidate: Candidate, size: int) -> None:
+        self.by_size[size].append(candidate)
+
+    async def drop_duplicate(self, path: Path, original: Candidate, target: Path, size: int) -> None:
+        """ Delete the duplicate, in 'link' mode - put a hard link to the kept copy in its place """
+        def drop():
+            if self.mode == 'link' and original.path is not None and Path(original.path) != target:
+                tmp = target.with_name(target.name + '.link')
+                os.link(original.path, tmp)
+                os.replace(tmp, target)
+            os.unlink(path)
+
+        await asyncio.to_thread(drop)
+        self.duplicates += 1
+        self.saved += size
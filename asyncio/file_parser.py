@@ -1,4 +1,9 @@
 import asyncio
+import itertools
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 # from queue import Queue, Empty
 # from threading import Thread, Event
@@ -7,28 +12,34 @@ from time import time
 from aiopath import AsyncPath
 
 THREAD_POOL_SIZE = 4
-
-# containers for file names
-IMAGES = asyncio.Queue()
-DOCUMENTS = asyncio.Queue()
-AUDIO = asyncio.Queue()
-VIDEO = asyncio.Queue()
-ARCHIVES = asyncio.Queue()
-OTHER = asyncio.Queue()
+# high-water mark of the work queue: the walker waits on `put()` while copiers are behind,
+# so the memory used by the queue doesn't depend on the size of the tree
+QUEUE_HIGH_WATER = 1_000
+# entries of a folder listing read at once (a huge folder isn't read into memory as a whole)
+SCAN_BATCH = 1_000
 
 # set of folders for sorting
 FOLDER_NAMES = ('archives', 'video', 'audio',
                 'documents', 'images', 'OTHER_TYPES')
 
-# dict to choose proper container based on the type of file
-EXTENSIONS_CONT = {
-    'images': IMAGES,
-    'documents': DOCUMENTS,
-    'audio': AUDIO,
-    'video': VIDEO,
-    'archives': ARCHIVES,
-    'OTHER_TYPES': OTHER
+# one queue of files for all types: items `(priority, number, file, type)`, so workers wait on one `get()`
+# instead of polling a queue per type; archives are the slowest to handle, so they are taken first
+WORK_QUEUE = asyncio.PriorityQueue(QUEUE_HIGH_WATER)
+PRIORITIES = {
+    'archives': 0,
+    'video': 1,
+    'audio': 2,
+    'images': 3,
+    'documents': 4,
+    'OTHER_TYPES': 5
 }
+# priority of the sentinel: a worker stops after all the files are handled
+STOP = len(PRIORITIES)
+# order of items with the same priority (files are never compared)
+SEQUENCE = itertools.count()
+
+# number of files of each type put into the queue
+FILES_COUNT = dict.fromkeys(FOLDER_NAMES, 0)
 
 # dict with types of files and known extensions
 EXTENSIONS_DICT = {
@@ -39,70 +50,164 @@ EXTENSIONS_DICT = {
     'archives': ('zip', 'tar', 'gztar')
 }
 
+# extension -> type of file (built once, so the type is found by one dict lookup)
+EXTENSION_TYPES = {ext: file_type for file_type, extensions in EXTENSIONS_DICT.items() for ext in extensions}
+
+# magic numbers (regex of the beginning of the file) of each type, they are checked in this order
+# for files with a missing or unknown extension
+# (there are no archives: zip is the container of odt, jar, epub, xlsx... and only files with an archive extension
+# are extracted, the rest are moved as is)
+MAGIC_NUMBERS = (
+    ('documents', rb'PK\x03\x04.{26}\[Content_Types\]\.xml'),  # docx, xlsx... (zip with Office content)
+    ('documents', rb'%PDF-|\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1|\{\\rtf'),
+    ('images', rb'\xff\xd8\xff|\x89PNG\r\n\x1a\n|GIF8[79]a|RIFF.{4}WEBP|.{4}ftyp(?:heic|heix|mif1|avif)'),
+    ('audio', rb'ID3|\xff[\xfb\xf3\xf2]|RIFF.{4}WAVE|fLaC|OggS|.{4}ftypM4A'),
+    ('video', rb'.{4}ftyp|\x1a\x45\xdf\xa3|RIFF.{4}AVI '),
+)
+# bytes read from the beginning of a file to find its type
+MAGIC_SIZE = 512
+# all the magic numbers in one regex: the name of the matched group is `<type>_<index>`
+MAGIC = re.compile(b'|'.join(b'(?P<%s_%d>%s)' % (file_type.encode(), index, pattern)
+                             for index, (file_type, pattern) in enumerate(MAGIC_NUMBERS)), re.DOTALL)
+
 FOLDERS = []
 EXTENSIONS = set()
 UNKNOWN = set()
-FOLDERS_UNKNOWN = []
+FOLDERS_UNKNOWN = set()
+
 
+def reset_queue(high_water: int = QUEUE_HIGH_WATER) -> None:
+    """
+    Replaces the work queue with an empty one bounded by `high_water` items
+    """
+    global WORK_QUEUE
+    WORK_QUEUE = asyncio.PriorityQueue(high_water)
 
-async def get_extension(filename: str) -> str:
-    return AsyncPath(filename).suffix[1:].lower()  # just changed to lower()
 
+async def put_file(fullname: AsyncPath, file_type: str) -> None:
+    FILES_COUNT[file_type] += 1
+    await WORK_QUEUE.put((PRIORITIES[file_type], next(SEQUENCE), fullname, file_type))
 
-def find_sub_folders(folder: Path, folder_queue_: asyncio.Queue) -> None:
+
+async def stop_workers(number: int) -> None:
     """
-    Finds all sub-folders of the folder and adds them to the list FOLDERS.
+    Put a sentinel for each worker (to be called when scanning is finished)
     """
-    for item in folder.iterdir():
-        if item.is_dir():
-            if item.name not in FOLDER_NAMES:
-                FOLDERS.append(item)
-                folder_queue_.put_nowait(item)
-                find_sub_folders(item, folder_queue_)
+    for _ in range(number):
+        await WORK_QUEUE.put((STOP, next(SEQUENCE), None, None))
+
 
+def get_extension(filename: str) -> str:
+    return os.path.splitext(filename)[1][1:].lower()  # just changed to lower()
 
-async def scan_folders(folder_queue_async_: asyncio.Queue, event_: asyncio.Event) -> None:  # , event: Event
+
+def get_file_type(ext: str) -> str | None:
+    """
+    Type of the file by its extension (None if the extension is unknown)
     """
-    Scans the folder and fill containers with files names sorted by their type,
-    names of folders and extensions.
+    return EXTENSION_TYPES.get(ext)
+
+
+def sniff(head: bytes) -> str | None:
     """
-    # print("Start working")
-    while not folder_queue_async_.empty():
+    Type of the file by the magic number in its first bytes (None if it's unknown)
+    """
+    match = MAGIC.match(head)
+    return match.lastgroup.rsplit('_', 1)[0] if match else None
+
+
+def classify(path: str, name: str) -> str | None:
+    """
+    Type of the file by its extension; if the extension is missing or unknown - by the first `MAGIC_SIZE` bytes
+    of the file (None if it's unknown too)
+    """
+    file_type = EXTENSION_TYPES.get(get_extension(name))
+    if file_type is None:
         try:
-            folder = AsyncPath(await folder_queue_async_.get())  # block=False
-        except asyncio.QueueEmpty:
-            break
-        else:
-            for item in Path(folder).iterdir():
-                if item.is_file():
-                    ext = await get_extension(item.name)  # взять расширение
-                    fullname = folder / item.name  # взять полный путь к файлу
-                    if not ext:  # если у файла нет расширения добавить к неизвестным
-                        await OTHER.put(fullname)
-                    else:
-                        for k, v in EXTENSIONS_DICT.items():
-                            # at first choose type of extension
-                            if ext in v:
-                                # then choose proper container
-                                container: asyncio.Queue = EXTENSIONS_CONT[k]
-                                EXTENSIONS.add(ext)
-                                await container.put(fullname)
-                                break
-                        else:
-                            # Если мы не регистрировали расширение в REGISTER_EXTENSIONS, то добавить в другое
-                            UNKNOWN.add(ext)
-                            await OTHER.put(fullname)
-                            # save folder that contain file with type OTHER
-                            FOLDERS_UNKNOWN.append(item.parent.absolute())
-            # folder_queue_async_.task_done()
-    event_.set()
-    # print("Finished")
-    # print(f'Images: {IMAGES.qsize()}')
-    # print(f'Documents: {DOCUMENTS.qsize()}')
-    # print(f'Audio: {AUDIO.qsize()}')
-    # print(f'Video: {VIDEO.qsize()}')
-    # print(f'Archives: {ARCHIVES.qsize()}')
-    # print(f'OTHER: {OTHER.qsize()}')
+            with open(path, 'rb') as file:
+                file_type = sniff(file.read(MAGIC_SIZE))
+        except OSError:
+            pass
+    return file_type
+
+
+def scan_batch(folder: str, entries, batch_size: int) -> tuple[list[tuple[str, str]], list[str], object]:
+    """
+    Names of files with their types (`classify`) and paths of sub-folders among the next `batch_size` entries
+    of the folder (is called in a thread of the pool, so files with unknown extensions are sniffed there).
+    The listing (`os.scandir` iterator, opened by the first batch) is returned to read the next batch,
+    None - when the folder is read to the end (or it can't be read, the error is reported).
+    Types of entries are taken from the directory listing (`DirEntry`), so there is no `stat` call per entry
+    """
+    files, folders, read = [], [], 0
+    try:
+        if entries is None:
+            entries = os.scandir(folder)
+        for entry in itertools.islice(entries, batch_size):
+            read += 1
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in FOLDER_NAMES:
+                    folders.append(entry.path)
+            elif entry.is_file():
+                files.append((entry.name, classify(entry.path, entry.name)))
+    except OSError as error:
+        # e.g. the folder can't be read or it has been removed: the rest of the tree is walked w/o it
+        print(f"Not possible to scan folder {folder}: {error}")
+        read = -1
+    if read < batch_size:
+        if entries is not None:
+            entries.close()
+        entries = None
+    return files, folders, entries
+
+
+async def walk_folders(root: Path, pool_size: int = THREAD_POOL_SIZE, batch_size: int = SCAN_BATCH) -> None:
+    """
+    Walks the tree of the folder in a pool of threads: files of each batch of a folder listing are classified and put
+    into the work queue as soon as the batch is read (sorting starts before the whole tree is walked),
+    sub-folders are added to the list FOLDERS (parents before children) and scanned in their turn.
+    No more than `pool_size` batches are read at once and the walker waits while the work queue is full,
+    so the walking never runs far ahead of the copiers.
+    """
+    loop = asyncio.get_running_loop()
+    to_scan = deque([str(root)])
+    pending = {}
+    with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='scandir') as pool:
+        while to_scan or pending:
+            while to_scan and len(pending) < pool_size:
+                folder = to_scan.popleft()
+                pending[loop.run_in_executor(pool, scan_batch, folder, None, batch_size)] = folder
+            done, _ = await asyncio.wait(set(pending), return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                folder = pending.pop(future)
+                files, folders, entries = future.result()
+                if entries is not None:
+                    # the next batch is read while this one is classified
+                    pending[loop.run_in_executor(pool, scan_batch, folder, entries, batch_size)] = folder
+                for sub_folder in folders:
+                    FOLDERS.append(Path(sub_folder))
+                    to_scan.append(sub_folder)
+                for name, file_type in files:
+                    await classify_file(folder, name, file_type)
+
+
+async def classify_file(folder: str, name: str, file_type: str | None) -> None:
+    """
+    Puts the file into the work queue with its type, saves extensions and folders with unknown types.
+    """
+    ext = get_extension(name)  # взять расширение
+    fullname = AsyncPath(folder) / name  # взять полный путь к файлу
+    if ext in EXTENSION_TYPES:
+        EXTENSIONS.add(ext)
+    elif ext:
+        # Если мы не регистрировали расширение в REGISTER_EXTENSIONS, то добавить в другое
+        UNKNOWN.add(ext)
+    if file_type is not None:
+        await put_file(fullname, file_type)
+    else:
+        await put_file(fullname, 'OTHER_TYPES')
+        # save folder that contain file with type OTHER
+        FOLDERS_UNKNOWN.add(Path(folder).absolute())
 
 
 async def main():
@@ -110,30 +215,13 @@ async def main():
     folder_for_scan = AsyncPath("testapp")
     print(f'Scanning folder {folder_for_scan}')
 
-    folder_queue_async = asyncio.Queue()
-    folder_queue_async.put_nowait(folder_for_scan)
-    find_sub_folders(Path(folder_for_scan), folder_queue_async)
-    print(f'Found {folder_queue_async.qsize()}')
-    # print(f'Folders: {list(folder_queue_async._queue)[:5]}')
-
     start = time()
-    event = asyncio.Event()
-
-    # await scan_folders(folder_queue_async, event)
-    # await folder_queue_async.join()
-
-    producers = [asyncio.create_task(scan_folders(folder_queue_async, event)) for _ in range(3)]
-
-    await asyncio.gather(*producers)
-    await folder_queue_async.join()
+    await walk_folders(Path(folder_for_scan))
 
     print(f"Execution time: {time() - start}")
-    print(f'Images: {IMAGES.qsize()}')
-    print(f'Documents: {DOCUMENTS.qsize()}')
-    print(f'Audio: {AUDIO.qsize()}')
-    print(f'Video: {VIDEO.qsize()}')
-    print(f'Archives: {ARCHIVES.qsize()}')
-    print(f'OTHER: {OTHER.qsize()}')
+    print(f'Found {len(FOLDERS)} folders')
+    for file_type, count in FILES_COUNT.items():
+        print(f'{file_type}: {count}')
 
 
 if __name__ == '__main__':
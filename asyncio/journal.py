@@ -0,0 +1,75 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+"""
+Write-ahead journal of a sorting run (SQLite in WAL mode): a move is recorded as 'planned' before the file is handled
+and as 'done' after it; an archive is recorded as 'extracted' (with paths of its members) before it's deleted. Files that have been handled are gone from the sorted tree, so a restarted run walks only
+the remaining work; the journal lets it finish moves interrupted by a crash and keeps the index of kept files
+for deduplication. The journal is deleted when the run is finished.
+"""
+
+PLANNED, EXTRACTED, DONE = 'planned', 'extracted', 'done'
+
+
+class Journal:
+    """ Journal of the moves of one sorted folder """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.connection = sqlite3.connect(self.path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # the WAL is synced on checkpoints only: a crash of the process loses nothing, a crash of the OS - the last moves
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS moves (source TEXT PRIMARY KEY, target TEXT, '
+                                'file_type TEXT, size INTEGER, state TEXT, action TEXT, members TEXT)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS moves_state ON moves (state)')
+
+    def plan(self, source, target, file_type: str, size: int) -> None:
+        self.connection.execute('INSERT OR REPLACE INTO moves VALUES (?, ?, ?, ?, ?, NULL, NULL)',
+                                (str(source), str(target), file_type, size, PLANNED))
+
+    def done(self, source, action: str) -> None:
+        """ `action`: 'move', 'extract', 'delete' or 'link' (for duplicates) """
+        self.connection.execute('UPDATE moves SET state = ?, action = ? WHERE source = ?', (DONE, action, str(source)))
+
+    def extracted(self, source, members: list[str]) -> None:
+        """ The archive has been extracted (`members` - paths of the written files), it's to be deleted """
+        self.connection.execute('UPDATE moves SET state = ?, members = ? WHERE source = ?',
+                                (EXTRACTED, json.dumps(members), str(source)))
+
+    def unfinished(self) -> list[tuple[str, str, str, str]]:
+        """ Source, target, type and state of moves that were planned, but haven't been finished """
+        return self.connection.execute('SELECT source, target, file_type, state FROM moves WHERE state IN (?, ?)',
+                                       (PLANNED, EXTRACTED)).fetchall()
+
+    def recover(self) -> int:
+        """
+        Finish interrupted moves: an extracted archive is deleted (it isn't extracted again), moves that have been
+        finished (their source is gone) are marked as done, the rest are handled again when the walker finds their
+        files (moving overwrites the target, so it's idempotent; an archive whose extraction has been interrupted
+        by a crash of the process is extracted again, members written before the crash get new names).
+        Returns the number of moves to be redone
+        """
+        redo = 0
+        for source, target, _, state in self.unfinished():
+            if state == EXTRACTED:
+                Path(source).unlink(missing_ok=True)
+                self.done(source, 'extract')
+            elif os.path.exists(source):
+                redo += 1
+            else:
+                self.done(source, 'move' if os.path.exists(target) else 'extract')
+        return redo
+
+    def kept(self) -> list[tuple[str, int]]:
+        """ Path and size of each file moved by the run (kept copies for deduplication) """
+        return self.connection.execute("SELECT target, size FROM moves WHERE state = ? AND action = 'move'",
+                                       (DONE,)).fetchall()
+
+    def close(self, finished: bool = False) -> None:
+        self.connection.close()
+        if finished:
+            for suffix in ('', '-wal', '-shm'):
+                Path(f'{self.path}{suffix}').unlink(missing_ok=True)
@@ -1,6 +1,7 @@
 import asyncio
 import os
 import shutil
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 # import sys
 from pathlib import Path
 from time import time, process_time
@@ -9,42 +10,90 @@ from aiofiles.os import wrap
 from aiopath import AsyncPath
 
 import file_parser as parser
+from dedup import Candidate, Deduplicator
+from journal import Journal
+from mover import CREATED_FOLDERS, forget_folders, make_folder, move_file
 from normalize import normalize
+from plan import MovePlan
+from unpacker import ARCHIVE_WORKERS, extract_archive
 
-copyfile = wrap(shutil.copy2)
+movefile = wrap(move_file)
 
 
 async def replace_file(file: AsyncPath, target_path: AsyncPath) -> None:
-    await copyfile(file, target_path)
+    await movefile(file, target_path)
 
 
-def archive_unpack(filename: Path, target_folder: Path):
-    folder_for_file = target_folder / normalize(filename.name.replace(filename.suffix, ''))
-    folder_for_file.mkdir(exist_ok=True, parents=True)
+async def async_archive_upack(filename: Path, sort_folder: Path, archive_pool: Executor = None) -> list[str] | None:
+    """
+    Extract the archive in the pool of processes straight into the folders of types of its members
+    (returns paths of the members, None if the file isn't an archive or it's damaged)
+    """
+    loop = asyncio.get_running_loop()
     try:
-        shutil.unpack_archive(str(filename.resolve()),
-                              str(folder_for_file.resolve()))
-    except shutil.ReadError:
-        print(f"{filename} isn't an archive!")
-        folder_for_file.rmdir()
-
+        return await loop.run_in_executor(archive_pool, extract_archive, str(filename), str(sort_folder))
+    except shutil.ReadError as error:
+        print(error)
+        return None
 
-async def async_archive_upack(filename: Path, target_folder: Path):
-    return await asyncio.to_thread(archive_unpack, filename, target_folder)
 
-
-async def handle_file(filename: AsyncPath, target_folder: AsyncPath, file_type: str):
+async def sort_file(filename: AsyncPath, sort_folder: AsyncPath, target_folder: AsyncPath, file_type: str,
+                    archive_pool: Executor = None, journal: Journal = None) -> AsyncPath | None:
+    """
+    Move the file into the target folder or extract the archive (returns the new path of the file, None if extracted)
+    """
+    if file_type == 'archives':
+        members = await async_archive_upack(Path(filename), Path(sort_folder), archive_pool)
+        if members is not None:
+            if journal is not None:
+                # a resumed run deletes the archive instead of extracting it again
+                journal.extracted(filename, members)
+            await filename.unlink()
+            return None
+    # rename on the same device, copy + unlink otherwise (a broken archive is kept in `archives`)
+    target = target_folder / normalize(filename.name)
+    await replace_file(filename, target)
+    return target
+
+
+async def handle_file(filename: AsyncPath, sort_folder: AsyncPath, file_type: str, archive_pool: Executor = None,
+                      dedup: Deduplicator = None, journal: Journal = None):
     # print("Handler: started")
     # await asyncio.sleep(0.1)
-    target_folder = target_folder / file_type
-    await target_folder.mkdir(exist_ok=True, parents=True)
-    if file_type != 'archives':
-        normalized_name = normalize(filename.name)
-        # await filename.replace(AsyncPath(target_folder) / normalized_name)  # + move `unlink' to the else-part
-        await replace_file(filename, target_folder / normalized_name)
-    else:
-        await async_archive_upack(Path(filename), Path(target_folder))
-    await filename.unlink()  # tab this `unlink` inside `else` to use `replace`
+    target_folder = sort_folder / file_type
+    # the folder is created by the first file of its type only (the set is checked w/o leaving the event loop)
+    if str(target_folder) not in CREATED_FOLDERS:
+        await asyncio.to_thread(make_folder, target_folder)
+    if dedup is None and journal is None:
+        await sort_file(filename, sort_folder, target_folder, file_type, archive_pool)
+        return
+
+    size = (await filename.stat()).st_size
+    target = target_folder / normalize(filename.name)
+    if journal is not None:
+        # the move is recorded before it's started, so it's finished after a crash
+        journal.plan(filename, target, file_type, size)
+    if dedup is None:
+        kept = await sort_file(filename, sort_folder, target_folder, file_type, archive_pool, journal)
+        if journal is not None:
+            journal.done(filename, 'move' if kept is not None else 'extract')
+        return
+
+    async with dedup.lock(size):
+        original, candidate = await dedup.find_original(Path(filename), size)
+        if original is not None:
+            await dedup.drop_duplicate(Path(filename), original, Path(target), size)
+            if journal is not None:
+                journal.done(filename, dedup.mode)
+            return
+        if file_type == 'archives':
+            # the archive is deleted after extraction (which reads it whole anyway), so it's hashed beforehand
+            await dedup.hash_candidate(candidate, Path(filename), size, full=True)
+        kept = await sort_file(filename, sort_folder, target_folder, file_type, archive_pool, journal)
+        candidate.path = Path(kept) if kept is not None else None
+        dedup.add(candidate, size)
+        if journal is not None:
+            journal.done(filename, 'move' if kept is not None else 'extract')
     # print("Handler: finished")
 
 
@@ -55,21 +104,53 @@ def handle_folder(folder_: Path) -> None:
         print(f'Not possible to delete folder {folder_}')
 
 
-async def worker_media(folder_: AsyncPath, event_: asyncio.Event):  # , event_: Event, lock_: RLock
+async def worker_media(folder_: AsyncPath, archive_pool: Executor = None, dedup: Deduplicator = None,
+                       journal: Journal = None):
+    """
+    Handle files from the work queue until the sentinel is taken (the worker sleeps on `get()` while the queue is empty)
+    """
     # print("Worker: started")
-    empty = False
-    while not (event_.is_set() and empty):
-        empty = True
-        for key, work_queue in parser.EXTENSIONS_CONT.items():
-            if not work_queue.empty():
-                file = await work_queue.get()
-                # print(f"File {file}")
-                await handle_file(file, folder_, key)
-                empty = False
-                work_queue.task_done()
-        if event_.is_set() and empty:
-            # print("Worker: stopped")
-            break
+    while True:
+        priority, _, file, file_type = await parser.WORK_QUEUE.get()
+        try:
+            if priority == parser.STOP:
+                # print("Worker: stopped")
+                break
+            await handle_file(file, folder_, file_type, archive_pool, dedup, journal)
+        except OSError as error:
+            # e.g. the file has been removed while it was waiting in the queue: the worker goes on with the next one
+            print(f"Not possible to sort {file}: {error}")
+        finally:
+            parser.WORK_QUEUE.task_done()
+
+
+async def run_copiers(sort_folder_: AsyncPath, copiers_number: int, archive_pool: Executor, dedup: Deduplicator = None,
+                      journal: Journal = None) -> None:
+    """
+    Walk the tree together with `copiers_number` copiers until all of them take their sentinels.
+    If a task fails, the rest are cancelled and the error is raised (otherwise the walker would wait forever
+    on `put()` into the full queue once the copiers are gone)
+    """
+    # the tree is walked in the pool of threads, copiers start with the files of the first scanned folder
+    await wait_all([scan_folder(sort_folder_, copiers_number)] +
+                   [worker_media(sort_folder_, archive_pool, dedup, journal) for _ in range(copiers_number)])
+
+
+async def scan_folder(sort_folder_: AsyncPath, workers_number: int) -> None:
+    await parser.walk_folders(Path(sort_folder_))
+    # workers finish the files left in the queue and stop on the sentinels
+    await parser.stop_workers(workers_number)
+
+
+async def wait_all(coroutines: list) -> None:
+    """ Run the coroutines as tasks; if one of them fails, the rest are cancelled and its error is raised """
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        task.result()
 
 
 def prepare_folder(target_folder: Path, source_folder: Path):
@@ -103,40 +184,182 @@ def sanitize_folder(sort_folder: Path, start_time_: float, start_time_cpu_: floa
     print(f"Number of files in the folder after sorting: {file_count}\n")
 
 
-async def start_sync(folder_queue_async_: asyncio.Queue, sort_folder_: AsyncPath, event_: asyncio.Event):
+def print_dedup_report(dedup: Deduplicator | None) -> None:
+    if dedup is not None:
+        print(f"Duplicates ({dedup.mode}): {dedup.duplicates}, saved {dedup.saved} bytes")
+
+
+def open_journal(journal_path: Path | None, dedup: Deduplicator | None) -> Journal | None:
+    """
+    Open the journal of the run (it's left only by an interrupted run): interrupted moves are recovered
+    and files kept before the interruption are added to the deduplication index
+    """
+    if journal_path is None:
+        return None
+    journal = Journal(journal_path)
+    redo = journal.recover()
+    kept = journal.kept()
+    if dedup is not None:
+        for target, size in kept:
+            dedup.add(Candidate(Path(target)), size)
+    if kept or redo:
+        print(f"Resuming: {len(kept)} files have been moved, {redo} interrupted moves will be redone")
+    return journal
+
+
+async def start_sync(sort_folder_: AsyncPath, high_water: int = parser.QUEUE_HIGH_WATER, dedup_mode: str = None,
+                     journal_path: Path = None):
     """
     Sorting without Threads
     """
     print(f"Start sync sorting ")
     start_time, start_time_cpu = time(), process_time()
-    await parser.scan_folders(folder_queue_async_, event_)
-    await worker_media(sort_folder_, event_)
+    parser.reset_queue(high_water)
+    forget_folders()
+    # one copier runs together with the walker: the walker waits for it when the queue is full
+    with ProcessPoolExecutor(max_workers=1) as archive_pool:
+        dedup = Deduplicator(dedup_mode, archive_pool) if dedup_mode else None
+        journal = open_journal(journal_path, dedup)
+        try:
+            await run_copiers(sort_folder_, 1, archive_pool, dedup, journal)
+        except BaseException:
+            # the journal is kept to resume the run
+            if journal is not None:
+                journal.close()
+            raise
+    if journal is not None:
+        journal.close(finished=True)
+    print_dedup_report(dedup)
 
     # delete remaining empty folders
     sanitize_folder(sort_folder_, start_time, start_time_cpu)
 
 
-async def start_async(folder_queue_async_: asyncio.Queue, sort_folder_: AsyncPath, event_: asyncio.Event):
+async def start_async(sort_folder_: AsyncPath, copiers_number: int = 5, high_water: int = parser.QUEUE_HIGH_WATER,
+                      archive_workers: int = ARCHIVE_WORKERS, dedup_mode: str = None, journal_path: Path = None):
     """
         Sorting using Threads
+        (`dedup_mode` - 'delete' or 'link' to drop exact duplicates, see `Deduplicator`;
+        `journal_path` - journal of the run, an interrupted run is resumed from it, see `Journal`)
         """
     print(f"Start async sorting ")
     start_time, start_time_cpu = time(), process_time()
-
-    scanners = [asyncio.create_task(parser.scan_folders(folder_queue_async_, event_)) for _ in range(2)]
-
-    copiers = [asyncio.create_task(worker_media(sort_folder_, event_)) for _ in range(5)]
-
-    await asyncio.gather(*scanners)
-    # await folder_queue_async_.join()
-    [await el.join() for el in parser.EXTENSIONS_CONT.values()]
-    for copier in copiers:
-        copier.cancel()
+    parser.reset_queue(high_water)
+    forget_folders()
+
+    # archives are extracted by `archive_workers` processes, copiers don't wait for each other on the GIL
+    with ProcessPoolExecutor(max_workers=archive_workers) as archive_pool:
+        # full hashes of possible duplicates are computed by the same processes
+        dedup = Deduplicator(dedup_mode, archive_pool) if dedup_mode else None
+        journal = open_journal(journal_path, dedup)
+        try:
+            await run_copiers(sort_folder_, copiers_number, archive_pool, dedup, journal)
+        except BaseException:
+            # the journal is kept to resume the run
+            if journal is not None:
+                journal.close()
+            raise
+    if journal is not None:
+        journal.close(finished=True)
+    print_dedup_report(dedup)
 
     # delete remaining empty folders
     sanitize_folder(sort_folder_, start_time, start_time_cpu)
 
 
+async def plan_sorting(sort_folder_: AsyncPath, plan_path: Path, high_water: int = parser.QUEUE_HIGH_WATER) -> MovePlan:
+    """
+    Dry run: the tree is walked and classified as for sorting, but nothing is moved - the move plan
+    (source, target, category, size of each file) is saved to `plan_path` to be reviewed and applied by `execute_plan`
+    """
+    print(f"Plan sorting of {sort_folder_}")
+    parser.reset_queue(high_water)
+    plan = MovePlan(sort_folder_)
+
+    async def collect():
+        while True:
+            priority, _, file, file_type = await parser.WORK_QUEUE.get()
+            parser.WORK_QUEUE.task_done()
+            if priority == parser.STOP:
+                break
+            try:
+                size = os.stat(file).st_size
+            except OSError as error:
+                print(f"Not possible to plan {file}: {error}")
+                continue
+            plan.add(file, sort_folder_ / file_type / normalize(file.name), file_type, size)
+
+    await wait_all([scan_folder(sort_folder_, 1), collect()])
+
+    plan.save(plan_path)
+    for category, info in plan.summary().items():
+        print(f"{category}: {info['files']} files, {info['bytes']} bytes")
+    print(f"Plan of {len(plan)} moves is saved to {plan_path}")
+    return plan
+
+
+def apply_batch(batch: list, sort_folder: str, archive_pool: Executor) -> int:
+    """
+    Move files of one target folder (is called in a thread), archives are extracted by the pool of processes.
+    Files that are gone are skipped (the plan has been applied already), so a plan can be replayed
+    """
+    moved, extractions = 0, []
+    for source, target, category, _ in batch:
+        if not os.path.exists(source):
+            continue
+        if category == 'archives':
+            # all the archives of the batch are submitted at once, so the processes of the pool extract them in parallel
+            extractions.append((source, target, archive_pool.submit(extract_archive, source, sort_folder)))
+            continue
+        move_file(source, target)
+        moved += 1
+    for source, target, extraction in extractions:
+        try:
+            extraction.result()
+        except shutil.ReadError as error:
+            print(error)
+            move_file(source, target)
+        else:
+            os.unlink(source)
+        moved += 1
+    return moved
+
+
+async def execute_plan(plan: MovePlan, workers: int = 5, archive_workers: int = ARCHIVE_WORKERS) -> int:
+    """
+    Apply the move plan: each target folder is created once, files are moved by batches of one target folder
+    in `workers` threads at once (archives - in `archive_workers` processes); empty source folders are deleted.
+    Returns the number of handled files
+    """
+    print(f"Execute plan of {len(plan)} moves")
+    start_time, start_time_cpu = time(), process_time()
+    forget_folders()
+    for folder in plan.folders:
+        make_folder(folder)
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=workers) as thread_pool, \
+            ProcessPoolExecutor(max_workers=archive_workers) as archive_pool:
+        moved = await asyncio.gather(*(loop.run_in_executor(thread_pool, apply_batch, batch, plan.root, archive_pool)
+                                       for _, batch in plan.batches()))
+
+    # source folders (with their parents inside the sorted folder), the deepest first
+    root = Path(plan.root)
+    folders = set()
+    for source in plan.sources:
+        for folder in Path(source).parents:
+            if folder == root or root not in folder.parents:
+                break
+            folders.add(folder)
+    for folder_ in sorted(folders, key=lambda folder: len(folder.parts), reverse=True):
+        if folder_.exists():
+            handle_folder(folder_)
+
+    print(f"Execution time (wall): {round((time() - start_time) * 1000)} ms")
+    print(f"Execution time (CPU): {round((process_time() - start_time_cpu) * 1000)} ms")
+    return sum(moved)
+
+
 async def main():
     # if sys.argv[1]:
     #     sort_path = sys.argv[1]
@@ -149,26 +372,19 @@ async def main():
 
     print("SORTING SYNC")
     prepare_folder(Path(sort_path), Path(garbage_path))  # Path(sort_path)
-
-    folder_queue_async = asyncio.Queue()
-    folder_queue_async.put_nowait(sort_folder)
-    parser.find_sub_folders(Path(sort_folder), folder_queue_async)
-    print(f'Found {folder_queue_async.qsize()}')
-
-    event = asyncio.Event()
-    await start_sync(folder_queue_async, sort_folder, event)
+    await start_sync(sort_folder)
 
     parser.FOLDERS = []
     print("SORTING ASYNC")
     prepare_folder(Path(sort_path), Path(garbage_path))
-    folder_queue_async = asyncio.Queue()
-    folder_queue_async.put_nowait(sort_folder)
-
-    parser.find_sub_folders(Path(sort_folder), folder_queue_async)
-    print(f'Found {folder_queue_async.qsize()}')
+    # the journal is kept outside the sorted folder (otherwise it'd be sorted too)
+    await start_async(sort_folder, dedup_mode='link', journal_path=Path(f'{sort_path}.journal'))
 
-    event = asyncio.Event()
-    await start_async(folder_queue_async, sort_folder, event)
+    parser.FOLDERS = []
+    print("SORTING BY PLAN")
+    prepare_folder(Path(sort_path), Path(garbage_path))
+    plan = await plan_sorting(sort_folder, Path(f'{sort_path}.plan.gz'))
+    await execute_plan(plan)
 
 
 if __name__ == '__main__':
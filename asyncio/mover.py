@@ -0,0 +1,104 @@
+import errno
+import os
+import shutil
+import threading
+from pathlib import Path
+
+# device (`st_dev`) of each target folder, they are few, so each one is checked once
+TARGET_DEVICES = {}
+# target folders created by the run: each one is created once instead of a `mkdir` per file
+CREATED_FOLDERS = set()
+FOLDERS_LOCK = threading.Lock()
+
+
+def make_folder(folder) -> None:
+    """
+    Create the folder (with parents) if it hasn't been created by the run yet; is safe to call from threads
+    and coroutines at once (the set is checked again under the lock, so `mkdir` is called once per folder)
+    """
+    key = str(folder)
+    if key in CREATED_FOLDERS:
+        return
+    with FOLDERS_LOCK:
+        if key not in CREATED_FOLDERS:
+            Path(key).mkdir(exist_ok=True, parents=True)
+            CREATED_FOLDERS.add(key)
+
+
+def reset_folders_lock() -> None:
+    """ A forked process of the pool gets a new lock (the lock of the parent may have been held by its thread) """
+    global FOLDERS_LOCK
+    FOLDERS_LOCK = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_folders_lock)
+
+
+def forget_folders() -> None:
+    """ Forget created folders (at the start of a run: they may have been deleted since the last one) """
+    with FOLDERS_LOCK:
+        CREATED_FOLDERS.clear()
+
+
+def target_device(target_folder: Path) -> int:
+    device = TARGET_DEVICES.get(target_folder)
+    if device is None:
+        device = TARGET_DEVICES[target_folder] = os.stat(target_folder).st_dev
+    return device
+
+
+def copy_file(source: Path, target: Path) -> None:
+    """
+    Copy the content of the file in the kernel: `os.copy_file_range` (may share blocks on CoW filesystems),
+    `os.sendfile` if it isn't supported, `shutil.copyfile` if neither of them is
+    """
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+                if not sent:
+                    break
+                copied += sent
+            if copied == size:
+                return
+        except (AttributeError, OSError):
+            pass
+        try:
+            while copied < size:
+                sent = os.sendfile(dst.fileno(), src.fileno(), copied, size - copied)
+                if not sent:
+                    break
+                copied += sent
+            if copied == size:
+                return
+        except (AttributeError, OSError):
+            pass
+    # neither of them is supported or the copy is short (e.g. the file is being changed): it's copied once again
+    shutil.copyfile(source, target)
+
+
+def move_file(source: Path, target: Path) -> None:
+    """
+    Move the file: atomic `os.replace` (rename) if the target folder is on the same device as the file,
+    otherwise the content is copied in the kernel (`copy_file`), metadata is copied as by `shutil.copy2`
+    and the file is deleted
+    """
+    source, target = Path(source), Path(target)
+    if os.stat(source).st_dev == target_device(target.parent):
+        try:
+            os.replace(source, target)
+            return
+        except OSError as error:
+            # e.g. bind mounts of one filesystem
+            if error.errno != errno.EXDEV:
+                raise
+    copy_file(source, target)
+    # the source is deleted only if the whole file has been copied
+    source_size, target_size = os.stat(source).st_size, os.stat(target).st_size
+    if target_size != source_size:
+        raise OSError(errno.EIO, f"Short copy ({target_size} of {source_size} bytes), the source is kept", str(source))
+    shutil.copystat(source, target)
+    os.unlink(source)
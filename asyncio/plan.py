@@ -0,0 +1,105 @@
+import gzip
+import json
+from pathlib import Path
+
+"""
+Move plan of a sorted folder: rows (source, target, category, size) stored by columns.
+Target folders and categories are dictionary-encoded (each row keeps the number of its folder and category),
+so the plan stays compact for millions of files and rows are grouped by target folder for free.
+The file is gzip-compressed JSON.
+"""
+
+PLAN_VERSION = 1
+
+
+class MovePlan:
+    """ Columns of the move plan """
+
+    def __init__(self, root: str = ''):
+        self.root = str(root)
+        self.folders = []
+        self.categories = []
+        self.sources = []
+        self.names = []
+        self.folder_codes = []
+        self.category_codes = []
+        self.sizes = []
+        self.folder_index = {}
+        self.category_index = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add(self, source, target, category: str, size: int) -> None:
+        target = Path(target)
+        folder = str(target.parent)
+        folder_code = self.folder_index.get(folder)
+        if folder_code is None:
+            folder_code = self.folder_index[folder] = len(self.folders)
+            self.folders.append(folder)
+        category_code = self.category_index.get(category)
+        if category_code is None:
+            category_code = self.category_index[category] = len(self.categories)
+            self.categories.append(category)
+        self.sources.append(str(source))
+        self.names.append(target.name)
+        self.folder_codes.append(folder_code)
+        self.category_codes.append(category_code)
+        self.sizes.append(size)
+
+    def batches(self, batch_size: int = 256):
+        """ Rows (source, target, category, size) grouped by target folder: (folder, rows) of up to `batch_size` rows """
+        groups = {}
+        for index, folder_code in enumerate(self.folder_codes):
+            groups.setdefault(folder_code, []).append(index)
+        for folder_code, indexes in groups.items():
+            folder = self.folders[folder_code]
+            for start in range(0, len(indexes), batch_size):
+                batch = [(self.sources[index], str(Path(folder) / self.names[index]),
+                          self.categories[self.category_codes[index]], self.sizes[index])
+                         for index in indexes[start:start + batch_size]]
+                yield folder, batch
+
+    def summary(self) -> dict:
+        """ Number of files and bytes of each category """
+        summary = {category: {'files': 0, 'bytes': 0} for category in self.categories}
+        for category_code, size in zip(self.category_codes, self.sizes):
+            summary[self.categories[category_code]]['files'] += 1
+            summary[self.categories[category_code]]['bytes'] += size
+        return summary
+
+    def save(self, path) -> None:
+        data = {
+            'version': PLAN_VERSION,
+            'root': self.root,
+            'folders': self.folders,
+            'categories': self.categories,
+            'columns': {
+                'source': self.sources,
+                'name': self.names,
+                'folder': self.folder_codes,
+                'category': self.category_codes,
+                'size': self.sizes,
+            },
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path) -> 'MovePlan':
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('version') != PLAN_VERSION:
+            raise ValueError(f"Unsupported version of the move plan: {data.get('version')}")
+        plan = cls(data['root'])
+        plan.folders = data['folders']
+        plan.categories = data['categories']
+        columns = data['columns']
+        plan.sources = columns['source']
+        plan.names = columns['name']
+        plan.folder_codes = columns['folder']
+        plan.category_codes = columns['category']
+        plan.sizes = columns['size']
+        plan.folder_index = {folder: code for code, folder in enumerate(plan.folders)}
+        plan.category_index = {category: code for code, category in enumerate(plan.categories)}
+        return plan
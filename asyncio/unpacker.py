@@ -0,0 +1,88 @@
+import itertools
+import lzma
+import os
+import shutil
+import tarfile
+import zipfile
+import zlib
+from pathlib import Path
+
+from file_parser import MAGIC_SIZE, get_extension, get_file_type, sniff
+from mover import make_folder
+from normalize import normalize
+
+# processes that extract archives (decompression is CPU-bound, so threads would wait for each other on the GIL)
+ARCHIVE_WORKERS = 2
+CHUNK_SIZE = 1 << 20
+# errors of reading a damaged (or encrypted) archive, they may be raised in the middle of a member
+ARCHIVE_ERRORS = (OSError, EOFError, RuntimeError, NotImplementedError, zlib.error, lzma.LZMAError,
+                  zipfile.BadZipFile, tarfile.TarError)
+
+
+def create_file(folder: Path, name: str):
+    """
+    Create a new file in the folder, an existing file is never overwritten: `name_1.ext`, `name_2.ext`...
+    are taken if the name is taken (e.g. by a member of the same archive from another folder)
+    """
+    stem, suffix = os.path.splitext(name)
+    for number in itertools.count():
+        try:
+            return open(folder / (f'{stem}_{number}{suffix}' if number else name), 'xb')
+        except FileExistsError:
+            continue
+
+
+def write_member(source, member_name: str, sort_folder: Path) -> str:
+    """
+    Write the member of the archive (file object) straight into the folder of its type
+    (nested folders of the archive are dropped, as they are for the sorted folder itself,
+    so members with the same name get unique names - the archive is deleted after extraction).
+    Returns the path of the written file, a partly written one is deleted
+    """
+    name = Path(member_name).name
+    # the beginning of the member is read anyway, so members with unknown extensions are sniffed for free
+    head = source.read(MAGIC_SIZE)
+    file_type = get_file_type(get_extension(name)) or sniff(head) or 'OTHER_TYPES'
+    target_folder = sort_folder / file_type
+    # each process of the pool has its own set of created folders
+    make_folder(target_folder)
+    with create_file(target_folder, normalize(name)) as target:
+        try:
+            target.write(head)
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+        except BaseException:
+            os.unlink(target.name)
+            raise
+    return target.name
+
+
+def extract_archive(archive: str, sort_folder: str) -> list[str]:
+    """
+    Extract members of the archive one by one into the folders of their types (is called in a process of the pool),
+    tar archives are read as a stream (no seeking, each member is decompressed once).
+    Returns paths of the extracted files, raises `shutil.ReadError` if the file isn't an archive or it's damaged
+    (members extracted before the error are deleted, so the archive is kept as a whole)
+    """
+    sort_folder = Path(sort_folder)
+    extracted = []
+    try:
+        if zipfile.is_zipfile(archive):
+            with zipfile.ZipFile(archive) as zip_file:
+                for info in zip_file.infolist():
+                    if not info.is_dir():
+                        with zip_file.open(info) as source:
+                            extracted.append(write_member(source, info.filename, sort_folder))
+        elif tarfile.is_tarfile(archive):
+            with tarfile.open(archive, 'r|*') as tar_file:
+                for member in tar_file:
+                    if member.isfile():
+                        extracted.append(write_member(tar_file.extractfile(member), member.name, sort_folder))
+        else:
+            raise shutil.ReadError(f"{archive} isn't an archive")
+    except ARCHIVE_ERRORS as error:
+        for path in extracted:
+            os.unlink(path)
+        if isinstance(error, shutil.ReadError):
+            raise
+        raise shutil.ReadError(f"{archive} is damaged: {error!r}") from None
+    return extracted